@@ -0,0 +1,93 @@
+#
+# Copyright 2026 iXsystems, Inc.
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+#####################################################################
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+
+def import_time(module):
+    out = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import {0}'.format(module)],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        check=True
+    )
+
+    modules = {}
+    for line in out.stderr.decode('utf-8').splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+
+        self_us, cumulative_us, name = line.split(':', 1)[1].split('|')
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+
+    return modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure import time of a module with -X importtime')
+    parser.add_argument('--module', default='freenas.utils')
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--top', type=int, default=10, help='Number of slowest dependencies to report')
+    parser.add_argument('--output', help='Write JSON results to this file instead of stdout')
+    args = parser.parse_args()
+
+    # Warm up bytecode caches
+    import_time(args.module)
+
+    runs = [import_time(args.module) for _ in range(args.runs)]
+    totals = [r[args.module][1] for r in runs]
+    last = runs[-1]
+
+    report = {
+        'python': sys.version,
+        'module': args.module,
+        'runs': args.runs,
+        'cumulative_us': {
+            'min': min(totals),
+            'median': statistics.median(totals),
+            'max': max(totals)
+        },
+        'modules_imported': len(last),
+        'slowest': [
+            {'module': name, 'self_us': s, 'cumulative_us': c}
+            for name, (s, c) in sorted(last.items(), key=lambda i: i[1][0], reverse=True)[:args.top]
+        ]
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
+    else:
+        json.dump(report, sys.stdout, indent=4)
+
+
+if __name__ == '__main__':
+    main()
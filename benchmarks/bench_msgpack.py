@@ -0,0 +1,192 @@
+#
+# Copyright 2026 iXsystems, Inc.
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+#####################################################################
+
+import argparse
+import array
+import datetime
+import json
+import os
+import socket
+import sys
+import threading
+import time
+import uuid
+import msgpack
+from freenas.utils import xsendmsg, xrecvmsg
+from freenas.utils.msgpack import MsgpackCodec, default, ext_hook
+
+
+MESSAGE_SIZES = [64, 4096, 65536, 1048576, 8388608]
+BUFSIZES = [4096, 65536, 1048576]
+
+
+def make_payloads(count):
+    now = datetime.datetime.now()
+    entity = lambda i: {
+        'id': str(uuid.uuid4()),
+        'name': 'tank/dataset{0}@auto-{1}'.format(i // 10, i),
+        'type': 'SNAPSHOT',
+        'properties': {
+            'used': {'rawvalue': str(i * 4096), 'value': '{0}K'.format(i * 4), 'source': 'NONE'},
+            'referenced': {'rawvalue': str(i * 8192), 'value': '{0}K'.format(i * 8), 'source': 'NONE'},
+            'creation': {'rawvalue': str(int(now.timestamp())), 'value': str(now), 'source': 'NONE'},
+        },
+        'holds': {},
+        'retention': None,
+        'replicable': True,
+    }
+
+    def nested(depth):
+        if depth == 0:
+            return {'value': 1, 'enabled': True, 'name': 'leaf'}
+
+        return {'level{0}'.format(i): nested(depth - 1) for i in range(4)}
+
+    return {
+        'entities': [entity(i) for i in range(count)],
+        'datetimes': [now + datetime.timedelta(seconds=i) for i in range(count)],
+        'uuids': [uuid.uuid4() for _ in range(count)],
+        'nested': nested(6),
+    }
+
+
+def measure(fn, duration):
+    ops = 0
+    start = time.perf_counter()
+    while True:
+        fn()
+        ops += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= duration:
+            return ops, elapsed
+
+
+def result(name, ops, elapsed, nbytes, **params):
+    return dict(
+        name=name,
+        params=params,
+        ops=ops,
+        seconds=elapsed,
+        ops_per_sec=ops / elapsed,
+        mb_per_sec=ops * nbytes / elapsed / 1048576
+    )
+
+
+def bench_codec(payloads, duration):
+    codec = MsgpackCodec()
+    for name, payload in payloads.items():
+        data = msgpack.packb(payload, default=default, use_bin_type=True)
+
+        ops, elapsed = measure(lambda: msgpack.packb(payload, default=default, use_bin_type=True), duration)
+        yield result('packb', ops, elapsed, len(data), payload=name)
+
+        ops, elapsed = measure(lambda: msgpack.unpackb(data, ext_hook=ext_hook, raw=False), duration)
+        yield result('unpackb', ops, elapsed, len(data), payload=name)
+
+        frame = codec.encode(payload)
+
+        ops, elapsed = measure(lambda: codec.encode(payload), duration)
+        yield result('codec_encode', ops, elapsed, len(frame), payload=name)
+
+        def decode():
+            codec.feed(frame)
+            return list(codec)
+
+        ops, elapsed = measure(decode, duration)
+        yield result('codec_decode', ops, elapsed, len(frame), payload=name)
+
+
+def bench_socket(size, bufsize, anc, duration):
+    left, right = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+    message = os.urandom(size)
+    rfd, wfd = os.pipe()
+    ancdata = [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array('i', [rfd]))] if anc else None
+    anclength = socket.CMSG_SPACE(array.array('i').itemsize) if anc else None
+    stop = threading.Event()
+
+    def sender():
+        try:
+            while not stop.is_set():
+                xsendmsg(left, message, ancdata, bufsize)
+        except OSError:
+            pass
+
+    def receive():
+        _, received = xrecvmsg(right, size, anclength)
+        for _, _, data in received:
+            for fd in array.array('i', data):
+                os.close(fd)
+
+    thread = threading.Thread(target=sender, daemon=True)
+    thread.start()
+    try:
+        ops, elapsed = measure(receive, duration)
+    finally:
+        stop.set()
+        right.close()
+        thread.join()
+        left.close()
+        os.close(rfd)
+        os.close(wfd)
+
+    return result('xsendmsg_xrecvmsg', ops, elapsed, size, size=size, bufsize=bufsize, ancdata=anc)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark msgpack codec and socket I/O primitives')
+    parser.add_argument('--duration', type=float, default=1.0, help='Seconds spent in every benchmark')
+    parser.add_argument('--count', type=int, default=1000, help='Number of items in list payloads')
+    parser.add_argument('--output', help='Write JSON results to this file instead of stdout')
+    parser.add_argument('--skip-codec', action='store_true')
+    parser.add_argument('--skip-socket', action='store_true')
+    args = parser.parse_args()
+
+    results = []
+    if not args.skip_codec:
+        results.extend(bench_codec(make_payloads(args.count), args.duration))
+
+    if not args.skip_socket:
+        for size in MESSAGE_SIZES:
+            for bufsize in BUFSIZES:
+                for anc in (False, True):
+                    results.append(bench_socket(size, bufsize, anc, args.duration))
+
+    report = {
+        'python': sys.version,
+        'msgpack': '.'.join(str(i) for i in msgpack.version),
+        'results': results
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
+    else:
+        json.dump(report, sys.stdout, indent=4)
+
+
+if __name__ == '__main__':
+    main()
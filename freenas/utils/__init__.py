@@ -27,26 +27,21 @@
 
 import os
 import re
-import codecs
-import logging
-import logging.handlers
 import copy
-import crypt
-import random
-import string
-import binascii
-import hashlib
+import collections
+import functools
+import itertools
+import math
 import threading
-import traceback
+import time
 import contextlib
-from datetime import timedelta
-from string import Template
-from freenas.utils.trace_logger import TraceLogger
 
 try:
     from bsd import fnmatch
+    fnmatch_regex = None
 except ImportError:
-    from fnmatch import fnmatch
+    from fnmatch import fnmatch, translate
+    fnmatch_regex = lambda pat: re.compile(translate(pat)).match
 
 ESCAPE_SEQUENCE_RE = re.compile(r'''
     ( \\U........      # 8-digit hex escapes
@@ -59,60 +54,36 @@ ESCAPE_SEQUENCE_RE = re.compile(r'''
 
 LOGGING_FORMAT = '%(asctime)s %(levelname)s %(name)s %(filename)s:%(lineno)d %(message)s'
 
-COUNTRY_CODES = {
-    "AFGHANISTAN": "AF", "ALAND ISLANDS": "AX", "ALBANIA": "AL", "ALGERIA": "DZ", "AMERICAN SAMOA": "AS",
-    "ANDORRA": "AD", "ANGOLA": "AO", "ANGUILLA": "AI", "ANTARCTICA": "AQ", "ANTIGUA AND BARBUDA": "AG",
-    "ARGENTINA": "AR", "ARMENIA": "AM", "ARUBA": "AW", "AUSTRALIA": "AU", "AUSTRIA": "AT", "AZERBAIJAN": "AZ",
-    "BAHAMAS": "BS", "BAHRAIN": "BH", "BANGLADESH": "BD", "BARBADOS": "BB", "BELARUS": "BY", "BELGIUM": "BE",
-    "BELIZE": "BZ", "BENIN": "BJ", "BERMUDA": "BM", "BHUTAN": "BT", "BOLIVIA, PLURINATIONAL STATE OF": "BO",
-    "BOSNIA AND HERZEGOVINA": "BA", "BOTSWANA": "BW", "BOUVET ISLAND": "BV", "BRAZIL": "BR",
-    "BRITISH INDIAN OCEAN TERRITORY": "IO", "BRUNEI DARUSSALAM": "BN", "BULGARIA": "BG", "BURKINA FASO": "BF",
-    "BURUNDI": "BI", "CAMBODIA": "KH", "CAMEROON": "CM", "CANADA": "CA", "CAPE VERDE": "CV", "CAYMAN ISLANDS": "KY",
-    "CENTRAL AFRICAN REPUBLIC": "CF", "CHAD": "TD", "CHILE": "CL", "CHINA": "CN", "CHRISTMAS ISLAND": "CX",
-    "COCOS (KEELING) ISLANDS": "CC", "COLOMBIA": "CO", "COMOROS": "KM", "CONGO": "CG",
-    "CONGO, THE DEMOCRATIC REPUBLIC OF THE": "CD", "COOK ISLANDS": "CK", "COSTA RICA": "CR", "COTE D'IVOIRE": "CI",
-    "CROATIA": "HR", "CUBA": "CU", "CYPRUS": "CY", "CZECH REPUBLIC": "CZ", "DENMARK": "DK", "DJIBOUTI": "DJ",
-    "DOMINICA": "DM", "DOMINICAN REPUBLIC": "DO", "ECUADOR": "EC", "EGYPT": "EG", "EL SALVADOR": "SV",
-    "EQUATORIAL GUINEA": "GQ", "ERITREA": "ER", "ESTONIA": "EE", "ETHIOPIA": "ET", "FALKLAND ISLANDS (MALVINAS)": "FK",
-    "FAROE ISLANDS": "FO", "FIJI": "FJ", "FINLAND": "FI", "FRANCE": "FR", "FRENCH GUIANA": "GF",
-    "FRENCH POLYNESIA": "PF", "FRENCH SOUTHERN TERRITORIES": "TF", "GABON": "GA", "GAMBIA": "GM", "GEORGIA": "GE",
-    "GERMANY": "DE", "GHANA": "GH", "GIBRALTAR": "GI", "GREECE": "GR", "GREENLAND": "GL", "GRENADA": "GD",
-    "GUADELOUPE": "GP", "GUAM": "GU", "GUATEMALA": "GT", "GUERNSEY": "GG", "GUINEA": "GN", "GUINEA-BISSAU": "GW",
-    "GUYANA": "GY", "HAITI": "HT", "HEARD ISLAND AND MCDONALD ISLANDS": "HM", "HOLY SEE (VATICAN CITY STATE)": "VA",
-    "HONDURAS": "HN", "HONG KONG": "HK", "HUNGARY": "HU", "ICELAND": "IS", "INDIA": "IN", "INDONESIA": "ID",
-    "IRAN, ISLAMIC REPUBLIC OF": "IR", "IRAQ": "IQ", "IRELAND": "IE", "ISLE OF MAN": "IM", "ISRAEL": "IL",
-    "ITALY": "IT", "JAMAICA": "JM", "JAPAN": "JP", "JERSEY": "JE", "JORDAN": "JO", "KAZAKHSTAN": "KZ", "KENYA": "KE",
-    "KIRIBATI": "KI", "KOREA, DEMOCRATIC PEOPLE'S REPUBLIC OF": "KP", "KOREA, REPUBLIC OF": "KR", "KUWAIT": "KW",
-    "KYRGYZSTAN": "KG", "LAO PEOPLE'S DEMOCRATIC REPUBLIC": "LA", "LATVIA": "LV", "LEBANON": "LB", "LESOTHO": "LS",
-    "LIBERIA": "LR", "LIBYAN ARAB JAMAHIRIYA": "LY", "LIECHTENSTEIN": "LI", "LITHUANIA": "LT", "LUXEMBOURG": "LU",
-    "MACAO": "MO", "MACEDONIA, THE FORMER YUGOSLAV REPUBLIC OF": "MK", "MADAGASCAR": "MG", "MALAWI": "MW",
-    "MALAYSIA": "MY", "MALDIVES": "MV", "MALI": "ML", "MALTA": "MT", "MARSHALL ISLANDS": "MH", "MARTINIQUE": "MQ",
-    "MAURITANIA": "MR", "MAURITIUS": "MU", "MAYOTTE": "YT", "MEXICO": "MX", "MICRONESIA, FEDERATED STATES OF": "FM",
-    "MOLDOVA, REPUBLIC OF": "MD", "MONACO": "MC", "MONGOLIA": "MN", "MONTENEGRO": "ME", "MONTSERRAT": "MS",
-    "MOROCCO": "MA", "MOZAMBIQUE": "MZ", "MYANMAR": "MM", "NAMIBIA": "NA", "NAURU": "NR", "NEPAL": "NP",
-    "NETHERLANDS": "NL", "NETHERLANDS ANTILLES": "AN", "NEW CALEDONIA": "NC", "NEW ZEALAND": "NZ", "NICARAGUA": "NI",
-    "NIGER": "NE", "NIGERIA": "NG", "NIUE": "NU", "NORFOLK ISLAND": "NF", "NORTHERN MARIANA ISLANDS": "MP",
-    "NORWAY": "NO", "OMAN": "OM", "PAKISTAN": "PK", "PALAU": "PW", "PALESTINIAN TERRITORY, OCCUPIED": "PS",
-    "PANAMA": "PA", "PAPUA NEW GUINEA": "PG", "PARAGUAY": "PY", "PERU": "PE", "PHILIPPINES": "PH", "PITCAIRN": "PN",
-    "POLAND": "PL", "PORTUGAL": "PT", "PUERTO RICO": "PR", "QATAR": "QA", "REUNION": "RE", "ROMANIA": "RO",
-    "RUSSIAN FEDERATION": "RU", "RWANDA": "RW", "SAINT BARTHELEMY": "BL",
-    "SAINT HELENA, ASCENSION AND TRISTAN DA CUNHA": "SH", "SAINT KITTS AND NEVIS": "KN", "SAINT LUCIA": "LC",
-    "SAINT MARTIN": "MF", "SAINT PIERRE AND MIQUELON": "PM", "SAINT VINCENT AND THE GRENADINES": "VC", "SAMOA": "WS",
-    "SAN MARINO": "SM", "SAO TOME AND PRINCIPE": "ST", "SAUDI ARABIA": "SA", "SENEGAL": "SN", "SERBIA": "RS",
-    "SEYCHELLES": "SC", "SIERRA LEONE": "SL", "SINGAPORE": "SG", "SLOVAKIA": "SK", "SLOVENIA": "SI",
-    "SOLOMON ISLANDS": "SB", "SOMALIA": "SO", "SOUTH AFRICA": "ZA",
-    "SOUTH GEORGIA AND THE SOUTH SANDWICH ISLANDS": "GS", "SPAIN": "ES", "SRI LANKA": "LK", "SUDAN": "SD",
-    "SURINAME": "SR", "SVALBARD AND JAN MAYEN": "SJ", "SWAZILAND": "SZ", "SWEDEN": "SE", "SWITZERLAND": "CH",
-    "SYRIAN ARAB REPUBLIC": "SY", "TAIWAN, PROVINCE OF CHINA": "TW", "TAJIKISTAN": "TJ",
-    "TANZANIA, UNITED REPUBLIC OF": "TZ", "THAILAND": "TH", "TIMOR-LESTE": "TL", "TOGO": "TG", "TOKELAU": "TK",
-    "TONGA": "TO", "TRINIDAD AND TOBAGO": "TT", "TUNISIA": "TN", "TURKEY": "TR", "TURKMENISTAN": "TM",
-    "TURKS AND CAICOS ISLANDS": "TC", "TUVALU": "TV", "UGANDA": "UG", "UKRAINE": "UA", "UNITED ARAB EMIRATES": "AE",
-    "UNITED KINGDOM": "GB", "UNITED STATES": "US", "UNITED STATES MINOR OUTLYING ISLANDS": "UM", "URUGUAY": "UY",
-    "UZBEKISTAN": "UZ", "VANUATU": "VU", "VENEZUELA, BOLIVARIAN REPUBLIC OF": "VE", "VIET NAM": "VN",
-    "VIRGIN ISLANDS, BRITISH": "VG", "VIRGIN ISLANDS, U.S.": "VI", "WALLIS AND FUTUNA": "WF", "WESTERN SAHARA": "EH",
-    "YEMEN": "YE", "ZAMBIA": "ZM", "ZIMBABWE": "ZW"
+# Rarely used names, imported from their modules on first access
+LAZY_ATTRIBUTES = {
+    'COUNTRY_CODES': 'freenas.utils.country_codes',
+    'TraceLogger': 'freenas.utils.trace_logger',
+    'FaultTolerantLogHandler': 'freenas.utils.log_handlers',
+    'BatchedLogHandler': 'freenas.utils.log_handlers',
+    'AsyncLogHandler': 'freenas.utils.log_handlers',
 }
 
+try:
+    IOV_MAX = os.sysconf('SC_IOV_MAX')
+except (ValueError, OSError):
+    IOV_MAX = 1024
+
+
+def __getattr__(name):
+    import importlib
+
+    module = LAZY_ATTRIBUTES.get(name)
+    if module is None:
+        raise AttributeError('module {0!r} has no attribute {1!r}'.format(__name__, name))
+
+    value = getattr(importlib.import_module(module), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(LAZY_ATTRIBUTES))
+
 
 def first_or_default(f, iterable, default=None):
     for i in filter(f, iterable):
@@ -136,6 +107,74 @@ def best_match(items, name, key=None, default=None):
     return max(matches, key=get_length)
 
 
+class PatternIndex(object):
+    def __init__(self, items=None, key=None, cache_size=4096):
+        self.key = key
+        self.trie = ({}, [])
+        self.seq = 0
+        self.match = functools.lru_cache(maxsize=cache_size)(self.lookup)
+        for i in items or []:
+            self.add(i)
+
+    @staticmethod
+    def literal_prefix(pat):
+        for idx, ch in enumerate(pat):
+            if ch in '*?[\\':
+                return pat[:idx]
+
+        return pat
+
+    def find_node(self, prefix, create=False):
+        node = self.trie
+        for ch in prefix:
+            children = node[0]
+            if ch not in children:
+                if not create:
+                    return None
+
+                children[ch] = ({}, [])
+
+            node = children[ch]
+
+        return node
+
+    def add(self, item):
+        pat = self.key(item) if self.key else item
+        matcher = fnmatch_regex(pat) if fnmatch_regex else lambda name, pat=pat: fnmatch(name, pat)
+        self.find_node(self.literal_prefix(pat), True)[1].append((-len(pat), self.seq, item, matcher))
+        self.seq += 1
+        self.match.cache_clear()
+
+    def remove(self, item):
+        pat = self.key(item) if self.key else item
+        node = self.find_node(self.literal_prefix(pat))
+        if node:
+            for idx, entry in enumerate(node[1]):
+                if entry[2] == item:
+                    del node[1][idx]
+                    self.match.cache_clear()
+                    return
+
+        raise ValueError('Pattern not found')
+
+    def lookup(self, name, default=None):
+        node = self.trie
+        candidates = list(node[1])
+        for ch in name:
+            node = node[0].get(ch)
+            if node is None:
+                break
+
+            candidates.extend(node[1])
+
+        candidates.sort(key=lambda e: (e[0], e[1]))
+        for _, _, item, matcher in candidates:
+            if matcher(name):
+                return item
+
+        return default
+
+
 def exclude(d, *keys):
     return {k: v for k, v in list(d.items()) if k not in keys}
 
@@ -195,17 +234,143 @@ def chunks(arr, size):
 
 
 def iter_chunked(iterable, chunksize):
-    ret = []
+    iterable = iter(iterable)
+    while True:
+        ret = list(itertools.islice(iterable, chunksize))
+        if not ret:
+            return
+
+        yield ret
+
+
+def apply_chunk(fn, chunk):
+    return [fn(i) for i in chunk]
+
+
+class Histogram(object):
+    # Bucket i holds values in (resolution * 2 ** (i - 1), resolution * 2 ** i]
+    def __init__(self, resolution, nbuckets=32):
+        self.resolution = resolution
+        self.buckets = [0] * nbuckets
+        self.count = 0
+        self.sum = 0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        idx = 0
+        if value > self.resolution:
+            idx = min(math.ceil(math.log2(value / self.resolution)), len(self.buckets) - 1)
+
+        self.buckets[idx] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, p):
+        if not self.count:
+            return None
+
+        rank = math.ceil(self.count * p / 100)
+        for idx, n in enumerate(itertools.accumulate(self.buckets)):
+            if n >= rank:
+                return min(self.resolution * 2 ** idx, self.max)
+
+    def __getstate__(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count if self.count else None,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99)
+        }
+
+
+class PipelineStats(object):
+    def __init__(self):
+        self.started_at = None
+        self.finished_at = None
+        self.submitted = 0
+        self.completed = 0
+        self.chunks = 0
+        self.in_flight = 0
+
+    @property
+    def elapsed(self):
+        if self.started_at is None:
+            return 0
+
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    @property
+    def throughput(self):
+        elapsed = self.elapsed
+        return self.completed / elapsed if elapsed else 0
+
+    def __getstate__(self):
+        return {
+            'submitted': self.submitted,
+            'completed': self.completed,
+            'chunks': self.chunks,
+            'in_flight': self.in_flight,
+            'elapsed': self.elapsed,
+            'throughput': self.throughput
+        }
+
+
+def parallel_map(fn, iterable, workers=None, chunksize=1, ordered=True, executor='thread', max_pending=None, stats=None):
+    from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+    if executor == 'thread':
+        pool = ThreadPoolExecutor(workers)
+    elif executor == 'process':
+        pool = ProcessPoolExecutor(workers)
+    else:
+        raise ValueError('Invalid executor type: {0}'.format(executor))
+
+    stats = stats or PipelineStats()
+    max_pending = max_pending or 2 * (workers or os.cpu_count() or 1)
+    chunks = iter_chunked(iterable, chunksize)
+    pending = collections.deque()
+    stats.started_at = time.monotonic()
+
+    def submit():
+        for chunk in chunks:
+            pending.append(pool.submit(apply_chunk, fn, chunk))
+            stats.submitted += len(chunk)
+            stats.chunks += 1
+            stats.in_flight += 1
+            if len(pending) >= max_pending:
+                return
+
+    def collect(future):
+        result = future.result()
+        stats.completed += len(result)
+        stats.in_flight -= 1
+        return result
+
     try:
-        while True:
-            ret.clear()
-            for i in range(chunksize):
-                ret.append(next(iterable))
+        submit()
+        while pending:
+            if ordered:
+                yield from collect(pending.popleft())
+            else:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pending.remove(future)
+                    yield from collect(future)
+
+            submit()
+    finally:
+        for future in pending:
+            future.cancel()
 
-            yield ret.copy()
-    except StopIteration:
-        if ret:
-            yield ret.copy()
+        pool.shutdown(wait=True)
+        stats.finished_at = time.monotonic()
 
 
 def remove_unchanged(d1, d2):
@@ -227,7 +392,122 @@ def deep_update(source, overrides):
     return source
 
 
+def deep_diff(old, new, list_key=None):
+    import difflib
+
+    ops = []
+
+    def same_item(a, b):
+        if a is b:
+            return True
+
+        if list_key and isinstance(a, dict) and isinstance(b, dict) and list_key in a:
+            return a.get(list_key) == b.get(list_key)
+
+        return type(a) is type(b) and a == b
+
+    def splice(path, index, remove, insert):
+        ops.append({'op': 'splice', 'path': path, 'index': index, 'remove': remove, 'insert': insert})
+
+    def keyed(lst):
+        return list_key and all(isinstance(i, dict) and list_key in i for i in lst)
+
+    def diff_list(path, a, b):
+        start = 0
+        end_a, end_b = len(a), len(b)
+        while start < end_a and start < end_b and same_item(a[start], b[start]):
+            diff(path + [start], a[start], b[start])
+            start += 1
+
+        while end_a > start and end_b > start and same_item(a[end_a - 1], b[end_b - 1]):
+            end_a -= 1
+            end_b -= 1
+
+        middle_a, middle_b = a[start:end_a], b[start:end_b]
+        if middle_a and middle_b and keyed(middle_a) and keyed(middle_b):
+            matcher = difflib.SequenceMatcher(
+                None,
+                [i[list_key] for i in middle_a],
+                [i[list_key] for i in middle_b],
+                autojunk=False
+            )
+
+            for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+                if tag == 'equal':
+                    for k in range(j2 - j1):
+                        diff(path + [start + j1 + k], middle_a[i1 + k], middle_b[j1 + k])
+                else:
+                    splice(path, start + j1, i2 - i1, middle_b[j1:j2])
+        elif len(middle_a) == len(middle_b):
+            for k in range(len(middle_b)):
+                diff(path + [start + k], middle_a[k], middle_b[k])
+        else:
+            splice(path, start, len(middle_a), middle_b)
+
+        offset = len(a) - len(b)
+        for i in range(end_b, len(b)):
+            diff(path + [i], a[i + offset], b[i])
+
+    def diff_dict(path, a, b):
+        for k in a:
+            if k not in b:
+                ops.append({'op': 'delete', 'path': path + [k]})
+
+        for k, v in b.items():
+            if k not in a:
+                ops.append({'op': 'set', 'path': path + [k], 'value': v})
+            else:
+                diff(path + [k], a[k], v)
+
+    def diff(path, a, b):
+        if a is b:
+            return
+
+        if isinstance(a, dict) and isinstance(b, dict):
+            diff_dict(path, a, b)
+        elif isinstance(a, list) and isinstance(b, list):
+            diff_list(path, a, b)
+        elif type(a) is not type(b) or a != b:
+            if not path:
+                raise ValueError('Cannot replace the root object')
+
+            ops.append({'op': 'set', 'path': path, 'value': b})
+
+    diff([], old, new)
+    return ops
+
+
+def apply_diff(source, diff):
+    for op in diff:
+        *parents, last = op['path'] or [None]
+        target = source
+        for key in parents:
+            if isinstance(target, dict):
+                target = target.setdefault(key, {})
+            else:
+                target = target[key]
+
+        if op['op'] == 'set':
+            target[last] = op['value']
+        elif op['op'] == 'delete':
+            if isinstance(target, dict):
+                target.pop(last, None)
+            else:
+                del target[last]
+        elif op['op'] == 'splice':
+            if last is not None:
+                target = target[last]
+
+            target[op['index']:op['index'] + op['remove']] = op['insert']
+        else:
+            raise ValueError('Invalid diff operation: {0}'.format(op['op']))
+
+    return source
+
+
 def decode_escapes(s):
+    import codecs
+
     def decode_match(match):
         return codecs.decode(match.group(0), 'unicode-escape')
 
@@ -235,6 +515,8 @@ def decode_escapes(s):
 
 
 def process_template(input, output, **kwargs):
+    from string import Template
+
     with open(input, 'r') as f:
         t = Template(f.read())
 
@@ -242,29 +524,155 @@ def process_template(input, output, **kwargs):
             dest.write(t.substitute(**kwargs))
 
 
-def materialized_paths_to_tree(lst, separator='.'):
-    result = {'children': {}, 'path': []}
+def write_if_changed(path, content):
+    if isinstance(content, str):
+        content = content.encode('utf-8')
 
-    def add(parent, path):
-        if not path:
-            return
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        st = None
+
+    if st and st.st_size == len(content):
+        with open(path, 'rb') as f:
+            if f.read() == content:
+                return False
+
+    tmp = os.path.join(os.path.dirname(path), '.{0}.{1}.{2}.tmp'.format(
+        os.path.basename(path), os.getpid(), threading.get_ident()
+    ))
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+    try:
+        with open(fd, 'wb') as f:
+            f.write(content)
+            if st:
+                os.fchmod(f.fileno(), st.st_mode & 0o7777)
+                try:
+                    os.fchown(f.fileno(), st.st_uid, st.st_gid)
+                except PermissionError:
+                    pass
+
+        os.replace(tmp, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(tmp)
 
-        p = path.pop(0)
-        c = parent['children'].get(p)
-        if not c:
-            c = {'children': {}, 'path': parent['path'] + [p], 'label': p}
-            parent['children'][p] = c
+        raise
 
-        add(c, path)
+    return True
+
+
+class TemplateRenderer(object):
+    def __init__(self):
+        self.templates = {}
+        self.lock = threading.Lock()
 
+    def get_template(self, path):
+        from string import Template
+
+        st = os.stat(path)
+        with self.lock:
+            entry = self.templates.get(path)
+            if entry and entry[0] == (st.st_mtime_ns, st.st_size):
+                return entry[1]
+
+        with open(path, 'r') as f:
+            t = Template(f.read())
+
+        with self.lock:
+            self.templates[path] = ((st.st_mtime_ns, st.st_size), t)
+
+        return t
+
+    def render(self, input, **kwargs):
+        return self.get_template(input).substitute(**kwargs)
+
+    def process(self, input, output, **kwargs):
+        return write_if_changed(output, self.render(input, **kwargs))
+
+    def process_many(self, templates, **kwargs):
+        changed = []
+        for i in templates:
+            input, output, *extra = i
+            params = extend(kwargs, extra[0]) if extra else kwargs
+            if self.process(input, output, **params):
+                changed.append(output)
+
+        return changed
+
+
+def tree_add_path(tree, path, separator='.'):
+    parts = path.split(separator) if isinstance(path, str) else list(path)
+    node = tree
+    for idx, p in enumerate(parts):
+        children = node['children']
+        c = children.get(p)
+        if c is None:
+            c = {'children': {}, 'path': parts[:idx + 1], 'label': p}
+            children[p] = c
+
+        node = c
+
+    # Marks paths that were inserted themselves rather than only created
+    # as ancestors, so tree_remove_path() knows which nodes it may prune
+    node['terminal'] = True
+    return node
+
+
+def tree_remove_path(tree, path, separator='.'):
+    parts = path.split(separator) if isinstance(path, str) else list(path)
+    nodes = [tree]
+    for p in parts[:-1]:
+        node = nodes[-1]['children'].get(p)
+        if node is None:
+            return None
+
+        nodes.append(node)
+
+    removed = nodes[-1]['children'].pop(parts[-1], None)
+    if removed is None:
+        return None
+
+    # Drop ancestors left without children unless they were inserted as
+    # paths themselves, so they don't turn into leaves nobody added
+    for parent, p in zip(reversed(nodes[:-1]), reversed(parts[:-1])):
+        node = parent['children'][p]
+        if node['children'] or node.get('terminal'):
+            break
+
+        del parent['children'][p]
+
+    return removed
+
+
+def materialized_paths_to_tree(lst, separator='.'):
+    result = {'children': {}, 'path': []}
     for i in lst:
-        path = i.split(separator)
-        add(result, path)
+        tree_add_path(result, i, separator)
 
     return result
 
 
+def tree_to_materialized_paths(tree, separator='.', leaves_only=True):
+    stack = [iter(tree['children'].values())]
+    while stack:
+        node = next(stack[-1], None)
+        if node is None:
+            stack.pop()
+            continue
+
+        if node['children']:
+            if not leaves_only:
+                yield separator.join(node['path'])
+
+            stack.append(iter(node['children'].values()))
+        else:
+            yield separator.join(node['path'])
+
+
 def to_timedelta(time_val):
+    from datetime import timedelta
+
     num = int(time_val[:-1])
 
     if time_val.endswith('s'):
@@ -283,8 +691,11 @@ def to_timedelta(time_val):
         return timedelta(days=(365 * num))
 
 
-def configure_logging(ident_or_path, level, file=False):
+def configure_logging(ident_or_path, level, file=False, async_=False, queue_size=10000, block=False, check_interval=1000):
+    import logging
     from freenas.logd import LogdLogHandler
+    from freenas.utils.trace_logger import TraceLogger
+    from freenas.utils.log_handlers import FaultTolerantLogHandler, BatchedLogHandler, AsyncLogHandler
 
     logging.setLoggerClass(TraceLogger)
     logging.basicConfig(
@@ -293,41 +704,75 @@ def configure_logging(ident_or_path, level, file=False):
     )
 
     if file:
-        handler = FaultTolerantLogHandler(ident_or_path)
+        if async_:
+            handler = BatchedLogHandler(ident_or_path, check_interval=check_interval)
+        else:
+            handler = FaultTolerantLogHandler(ident_or_path)
+
         handler.setFormatter(logging.Formatter(LOGGING_FORMAT))
     else:
         handler = LogdLogHandler(ident=ident_or_path)
 
+    if async_:
+        handler = AsyncLogHandler(handler, queue_size=queue_size, block=block)
+
     logging.root.removeHandler(logging.root.handlers[0])
     logging.root.addHandler(handler)
 
 
-def load_module_from_file(name, path):
+def load_module_from_file(name, path, lazy=False):
+    import sys
     import importlib.machinery
+    import importlib.util
 
     _, ext = os.path.splitext(path)
 
     if ext == '.py':
+        # SourceFileLoader uses the __pycache__ bytecode only if its recorded
+        # source mtime and size still match, and rewrites it otherwise
         loader = importlib.machinery.SourceFileLoader(name, path)
-        pyc_path = os.path.join(
-            os.path.dirname(path),
-            '__pycache__',
-            '{0}.cpython-36.pyc'.format(os.path.basename(path).split('.', 1)[0])
-        )
-        if os.path.isfile(pyc_path):
-            if os.path.getmtime(pyc_path) > os.path.getmtime(path):
-                loader = importlib.machinery.SourcelessFileLoader(name, pyc_path)
     elif ext == '.pyc':
         loader = importlib.machinery.SourcelessFileLoader(name, path)
     elif ext == '.so':
         loader = importlib.machinery.ExtensionFileLoader(name, path)
+        lazy = False
     else:
         raise ValueError('Invalid module file extension')
 
-    return loader.load_module()
+    if lazy:
+        loader = importlib.util.LazyLoader(loader)
 
+    spec = importlib.util.spec_from_file_location(name, path, loader=loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    try:
+        loader.exec_module(module)
+    except BaseException:
+        del sys.modules[name]
+        raise
 
-def xsendmsg(sock, buffer, ancdata=None, bufsize=65536):
+    return module
+
+
+def load_modules_from_directory(directory, prefix='', lazy=False, timings=None):
+    modules = {}
+    for filename in sorted(os.listdir(directory)):
+        name = filename.split('.', 1)[0]
+        _, ext = os.path.splitext(filename)
+        if not name or name.startswith('_') or ext not in ('.py', '.so') or name in modules:
+            continue
+
+        start = time.monotonic()
+        modules[name] = load_module_from_file(prefix + name, os.path.join(directory, filename), lazy)
+        if timings is not None:
+            timings[name] = time.monotonic() - start
+
+    return modules
+
+
+def sendmsg_steps(sock, buffer, ancdata=None, bufsize=65536):
+    # Shared by the sync and async variants: yields whenever the socket
+    # would block, with True meaning "wait until writable"
     done = 0
     view = memoryview(buffer)
     while done < len(buffer):
@@ -335,30 +780,180 @@ def xsendmsg(sock, buffer, ancdata=None, bufsize=65536):
             done += sock.sendmsg([view[done:done+bufsize]], ancdata or [])
         except InterruptedError:
             continue
+        except BlockingIOError:
+            yield True
+            continue
 
         ancdata = None
 
 
-def xrecvmsg(sock, length, anclength=None):
+def sendmsgv_steps(sock, buffers, ancdata=None):
+    views = [memoryview(b).cast('B') for b in buffers]
+    views = [v for v in views if len(v)]
+    idx = 0
+
+    while idx < len(views):
+        try:
+            nbytes = sock.sendmsg(views[idx:idx + IOV_MAX], ancdata or [])
+        except InterruptedError:
+            continue
+        except BlockingIOError:
+            yield True
+            continue
+
+        ancdata = None
+        while nbytes:
+            view = views[idx]
+            if nbytes < len(view):
+                views[idx] = view[nbytes:]
+                break
+
+            nbytes -= len(view)
+            idx += 1
+
+
+def recvmsg_into_steps(sock, buffer, length=None, anclength=None):
+    view = memoryview(buffer).cast('B')
+    if length is not None:
+        view = view[:length]
+
     done = 0
-    message = bytearray(length)
-    view = memoryview(message)
     ancdata = []
 
-    while done < length:
+    while done < len(view):
         try:
-            nbytes, anc, _, _ = sock.recvmsg_into([view], anclength or 0)
+            nbytes, anc, _, _ = sock.recvmsg_into([view[done:]], anclength or 0)
         except InterruptedError:
             continue
+        except BlockingIOError:
+            yield False
+            continue
 
         if nbytes == 0:
-            return message[:done], ancdata
+            break
 
         done += nbytes
         ancdata += anc
-        view = view[nbytes:]
 
-    return message, ancdata
+    return view[:done], ancdata
+
+
+def recvmsg_steps(sock, length, anclength=None):
+    message = bytearray(length)
+    view, ancdata = yield from recvmsg_into_steps(sock, message, length, anclength)
+    done = len(view)
+    view.release()
+    return message if done == length else message[:done], ancdata
+
+
+def run_steps(sock, steps):
+    # selectors rather than select(), which can't handle fds >= FD_SETSIZE
+    import selectors
+
+    selector = None
+    try:
+        while True:
+            event = selectors.EVENT_WRITE if next(steps) else selectors.EVENT_READ
+            if selector is None:
+                selector = selectors.DefaultSelector()
+                selector.register(sock, event)
+            else:
+                selector.modify(sock, event)
+
+            selector.select()
+    except StopIteration as result:
+        return result.value
+    finally:
+        if selector is not None:
+            selector.close()
+
+
+async def run_steps_async(sock, steps, loop=None):
+    if sock.gettimeout() != 0:
+        raise ValueError('Socket must be in non-blocking mode')
+
+    try:
+        while True:
+            await wait_socket(sock, next(steps), loop)
+    except StopIteration as result:
+        return result.value
+
+
+def xsendmsg(sock, buffer, ancdata=None, bufsize=65536):
+    run_steps(sock, sendmsg_steps(sock, buffer, ancdata, bufsize))
+
+
+def xrecvmsg(sock, length, anclength=None):
+    return run_steps(sock, recvmsg_steps(sock, length, anclength))
+
+
+async def wait_socket(sock, write=False, loop=None):
+    import asyncio
+
+    loop = loop or asyncio.get_event_loop()
+    fd = sock.fileno()
+    future = loop.create_future()
+    add, remove = (loop.add_writer, loop.remove_writer) if write else (loop.add_reader, loop.remove_reader)
+
+    add(fd, lambda: future.done() or future.set_result(None))
+    try:
+        await future
+    finally:
+        remove(fd)
+
+
+async def xsendmsg_async(sock, buffer, ancdata=None, bufsize=65536, loop=None):
+    await run_steps_async(sock, sendmsg_steps(sock, buffer, ancdata, bufsize), loop)
+
+
+async def xrecvmsg_async(sock, length, anclength=None, loop=None):
+    return await run_steps_async(sock, recvmsg_steps(sock, length, anclength), loop)
+
+
+def xsendmsgv(sock, buffers, ancdata=None):
+    run_steps(sock, sendmsgv_steps(sock, buffers, ancdata))
+
+
+async def xsendmsgv_async(sock, buffers, ancdata=None, loop=None):
+    await run_steps_async(sock, sendmsgv_steps(sock, buffers, ancdata), loop)
+
+
+def xrecvmsg_into(sock, buffer, length=None, anclength=None):
+    return run_steps(sock, recvmsg_into_steps(sock, buffer, length, anclength))
+
+
+async def xrecvmsg_into_async(sock, buffer, length=None, anclength=None, loop=None):
+    return await run_steps_async(sock, recvmsg_into_steps(sock, buffer, length, anclength), loop)
+
+
+class BufferPool(object):
+    def __init__(self, maxbuffers=16):
+        self.maxbuffers = maxbuffers
+        self.buffers = []
+        self.lock = threading.Lock()
+
+    def acquire(self, length):
+        with self.lock:
+            for idx, buf in enumerate(self.buffers):
+                if len(buf) >= length:
+                    return self.buffers.pop(idx)
+
+        return bytearray(length)
+
+    def release(self, buffer):
+        with self.lock:
+            if len(self.buffers) < self.maxbuffers:
+                self.buffers.append(buffer)
+
+    @contextlib.contextmanager
+    def recvmsg(self, sock, length, anclength=None):
+        buffer = self.acquire(length)
+        view, ancdata = xrecvmsg_into(sock, buffer, length, anclength)
+        try:
+            yield view, ancdata
+        finally:
+            view.release()
+            self.release(buffer)
 
 
 def in_directory(d1, d2):
@@ -375,28 +970,123 @@ def is_ascii(s):
 
 
 def remove_non_printable(s):
+    import string
+
     return ''.join(x for x in s if x in string.printable)
 
 
+def hash_file(fname, algo='sha256', b_size=65536, buffer=None):
+    import hashlib
+
+    hash = hashlib.new(algo)
+    if buffer is None:
+        buffer = bytearray(b_size)
+
+    view = memoryview(buffer)
+    with open(fname, 'rb', buffering=0) as f:
+        while True:
+            nbytes = f.readinto(buffer)
+            if not nbytes:
+                break
+
+            hash.update(view[:nbytes])
+
+    return hash.hexdigest()
+
+
 def sha256(fname, b_size=65536):
-    hash_sha256 = hashlib.sha256()
-    with open(fname, "rb") as f:
-        for chunk in iter(lambda: f.read(b_size), b""):
-            hash_sha256.update(chunk)
-    return hash_sha256.hexdigest()
+    return hash_file(fname, 'sha256', b_size)
+
+
+class HashCache(object):
+    def __init__(self, path=None):
+        self.path = path
+        self.entries = {}
+        self.lock = threading.Lock()
+
+        if path and os.path.exists(path):
+            import json
+
+            try:
+                with open(path, 'r') as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                self.entries = {}
+
+    @staticmethod
+    def key(algo, st):
+        return '{0}:{1}:{2}:{3}:{4}'.format(algo, st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def get(self, algo, st):
+        with self.lock:
+            return self.entries.get(self.key(algo, st))
+
+    def put(self, algo, st, digest):
+        with self.lock:
+            self.entries[self.key(algo, st)] = digest
+
+    def save(self):
+        import json
+
+        with self.lock:
+            entries = dict(self.entries)
+
+        tmp = '{0}.{1}.tmp'.format(self.path, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(entries, f)
+
+        os.replace(tmp, self.path)
+
+
+def hash_files(paths, algo='sha256', workers=None, cache=None, b_size=65536):
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    local = threading.local()
+
+    def hash_one(path):
+        st = os.stat(path)
+        if cache:
+            digest = cache.get(algo, st)
+            if digest:
+                return path, digest
+
+        # One read buffer per worker thread, reused for every file it hashes
+        buffer = getattr(local, 'buffer', None)
+        if buffer is None:
+            buffer = local.buffer = bytearray(b_size)
+
+        digest = hash_file(path, algo, b_size, buffer)
+        if cache:
+            cache.put(algo, st, digest)
+
+        return path, digest
+
+    with ThreadPoolExecutor(workers) as executor:
+        futures = [executor.submit(hash_one, p) for p in paths]
+        for f in as_completed(futures):
+            yield f.result()
 
 
 def crypted_password(cleartext):
+    import crypt
+    import random
+    import string
+
     return crypt.crypt(cleartext, '$6$' + ''.join([
         random.choice(string.ascii_letters + string.digits) for _ in range(16)]))
 
 
 def nt_password(cleartext):
+    import binascii
+    import hashlib
+
     nthash = hashlib.new('md4', cleartext.encode('utf-16le')).digest()
     return binascii.hexlify(nthash).decode('utf-8').upper()
 
 
 def serialize_traceback(tb):
+    import traceback
+
     iter_tb = tb if isinstance(tb, (list, tuple)) else traceback.extract_tb(tb)
     return [
         {
@@ -432,6 +1122,91 @@ class threadsafe_iterator(object):
             return self.it.__next__()
 
 
+class concurrent_iterator(object):
+    END = object()
+
+    def __init__(self, it, batch_size=64, prefetch=0):
+        self.it = iter(it)
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.error = None
+        self.finished = False
+        self.queue = None
+
+        if prefetch:
+            import queue
+
+            self.queue = queue.Queue(prefetch)
+            self.thread = threading.Thread(target=self.prefetch, daemon=True)
+            self.thread.start()
+
+    def read_batch(self):
+        batch = []
+        try:
+            for _ in range(self.batch_size):
+                batch.append(next(self.it))
+        except StopIteration:
+            return batch, self.END
+        except BaseException as err:
+            return batch, err
+
+        return batch, None
+
+    def prefetch(self):
+        while True:
+            batch, status = self.read_batch()
+            if batch:
+                self.queue.put(batch)
+
+            if status is not None:
+                self.queue.put(status)
+                return
+
+    def next_batch(self):
+        if self.queue:
+            batch = self.queue.get()
+            if isinstance(batch, list):
+                return batch, None
+
+            # Leave the end marker for the other consumers
+            self.queue.put(self.END)
+            return [], batch
+
+        with self.lock:
+            if self.finished:
+                return [], self.END
+
+            batch, status = self.read_batch()
+            if status is not None:
+                self.finished = True
+
+            return batch, status
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        local = self.local
+        buffer = getattr(local, 'buffer', None)
+        if not buffer:
+            error = getattr(local, 'error', None)
+            if error is None:
+                batch, status = self.next_batch()
+                local.buffer = buffer = collections.deque(batch)
+                if status is not self.END:
+                    error = status
+
+            local.error = error if buffer else None
+            if not buffer:
+                if error is not None:
+                    raise error
+
+                raise StopIteration
+
+        return buffer.popleft()
+
+
 @contextlib.contextmanager
 def create_with_mode(path, mode):
     umask = os.umask(0)
@@ -443,14 +1218,6 @@ def create_with_mode(path, mode):
         os.umask(umask)
 
 
-class FaultTolerantLogHandler(logging.handlers.WatchedFileHandler):
-    def emit(self, record):
-        try:
-            logging.handlers.WatchedFileHandler.emit(self, record)
-        except IOError:
-            pass
-
-
 def human_readable_bytes(num, suffix=''):
     for unit in ['B', 'KiB', 'MiB', 'GiB', 'TiB', 'PiB', 'EiB', 'ZiB']:
         if abs(num) < 1024.0:
@@ -111,3 +111,18 @@ class DebugService(RpcService):
     def snapshot_tracemalloc(self):
         snap = tracemalloc.take_snapshot()
         return [str(i) for i in snap.statistics('lineno')[:100]]
+
+    @private
+    def start_command_accounting(self, slow_threshold=None):
+        from freenas.utils.pipesubr import enable_accounting
+        enable_accounting(slow_threshold)
+
+    @private
+    def stop_command_accounting(self):
+        from freenas.utils.pipesubr import disable_accounting
+        disable_accounting()
+
+    @private
+    def get_command_stats(self):
+        from freenas.utils.pipesubr import get_command_stats
+        return get_command_stats()
@@ -0,0 +1,154 @@
+#
+# Copyright 2015 iXsystems, Inc.
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+#####################################################################
+
+import time
+import queue
+import threading
+import logging
+import logging.handlers
+
+
+class FaultTolerantLogHandler(logging.handlers.WatchedFileHandler):
+    def emit(self, record):
+        try:
+            logging.handlers.WatchedFileHandler.emit(self, record)
+        except IOError:
+            pass
+
+
+class BatchedLogHandler(FaultTolerantLogHandler):
+    def __init__(self, filename, check_interval=1000, **kwargs):
+        super(BatchedLogHandler, self).__init__(filename, **kwargs)
+        self.check_interval = check_interval / 1000
+        self.last_check = time.monotonic()
+
+    def reopenIfNeeded(self):
+        now = time.monotonic()
+        if now - self.last_check < self.check_interval:
+            return
+
+        self.last_check = now
+        super(BatchedLogHandler, self).reopenIfNeeded()
+
+    def emit_batch(self, records):
+        try:
+            text = ''.join(self.format(r) + self.terminator for r in records)
+        except Exception:
+            self.handleError(records[0])
+            return
+
+        try:
+            self.acquire()
+            try:
+                self.reopenIfNeeded()
+                if self.stream is None:
+                    self.stream = self._open()
+
+                self.stream.write(text)
+                self.stream.flush()
+            finally:
+                self.release()
+        except IOError:
+            pass
+
+
+class AsyncLogHandler(logging.Handler):
+    def __init__(self, handler, queue_size=10000, block=False, batch_size=256):
+        super(AsyncLogHandler, self).__init__()
+        self.handler = handler
+        self.queue = queue.Queue(queue_size)
+        self.block = block
+        self.batch_size = batch_size
+        self.dropped = 0
+        self.thread = threading.Thread(target=self.writer, name='AsyncLogHandler', daemon=True)
+        self.thread.start()
+
+    @property
+    def queue_depth(self):
+        return self.queue.qsize()
+
+    def __getstate__(self):
+        return {
+            'dropped': self.dropped,
+            'queue_depth': self.queue_depth,
+            'queue_size': self.queue.maxsize
+        }
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = (self.handler.formatter or logging.Formatter()).formatException(record.exc_info)
+
+            record.exc_info = None
+
+        return record
+
+    def emit(self, record):
+        try:
+            record = self.prepare(record)
+        except Exception:
+            self.handleError(record)
+            return
+
+        try:
+            self.queue.put(record, block=self.block)
+        except queue.Full:
+            self.dropped += 1
+
+    def writer(self):
+        while True:
+            records = [self.queue.get()]
+            try:
+                while len(records) < self.batch_size:
+                    records.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+
+            done = records[-1] is None
+            if done:
+                records.pop()
+
+            records = [r for r in records if r is not None]
+            if records:
+                if hasattr(self.handler, 'emit_batch'):
+                    self.handler.emit_batch(records)
+                else:
+                    for r in records:
+                        self.handler.handle(r)
+
+            if done:
+                return
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+        self.handler.close()
+        super(AsyncLogHandler, self).close()
@@ -28,9 +28,23 @@
 import enum
 import uuid
 import re
+import array
+import importlib.util
+import os
+import socket
+import struct
+import zlib
 from datetime import datetime
 from dateutil.parser import parse
-from msgpack import ExtType
+from msgpack import ExtType, Packer, unpackb
+from freenas.utils import xsendmsgv, xsendmsgv_async, wait_socket, first_or_default
+
+
+# Frame header: payload length, number of passed descriptors, flags
+# (low byte holds the compression algorithm, see negotiate())
+FRAME_HEADER = struct.Struct('<IHH')
+FRAME_COMPRESSION_MASK = 0xff
+MAX_FRAME_SIZE = 256 * 1024 * 1024
 
 
 class ExtTypes(enum.IntEnum):
@@ -67,3 +81,347 @@ def ext_hook(code, data):
 
     if code == ExtTypes.REGEX:
         return re.compile(data.decode('utf-8'))
+
+
+class Compression(enum.IntEnum):
+    NONE = 0
+    ZLIB = 1
+    LZMA = 2
+    LZ4 = 3
+    ZSTD = 4
+
+
+def check_decompressed(eof, max_length):
+    if not eof:
+        raise ValueError('Compressed frame is truncated or expands beyond {0} bytes'.format(max_length))
+
+
+def zlib_decompress(data, max_length):
+    decompressor = zlib.decompressobj()
+    result = decompressor.decompress(data, max_length)
+    check_decompressed(decompressor.eof, max_length)
+    return result
+
+
+# lzma, lz4 and zstandard are only imported once a frame actually uses them
+
+def lzma_compress(data):
+    import lzma
+    return lzma.compress(data)
+
+
+def lzma_decompress(data, max_length):
+    import lzma
+
+    decompressor = lzma.LZMADecompressor()
+    result = decompressor.decompress(data, max_length)
+    check_decompressed(decompressor.eof, max_length)
+    return result
+
+
+def lz4_compress(data):
+    import lz4.frame
+    return lz4.frame.compress(data)
+
+
+def lz4_decompress(data, max_length):
+    import lz4.frame
+
+    decompressor = lz4.frame.LZ4FrameDecompressor()
+    result = decompressor.decompress(data, max_length=max_length)
+    check_decompressed(decompressor.eof, max_length)
+    return result
+
+
+def zstd_compress(data):
+    import zstandard
+    return zstandard.ZstdCompressor().compress(data)
+
+
+def zstd_decompress(data, max_length):
+    import zstandard
+
+    # Frames may carry a content size, so stream instead of trusting it
+    chunks = []
+    total = 0
+    with zstandard.ZstdDecompressor().stream_reader(data) as reader:
+        while True:
+            chunk = reader.read(65536)
+            if not chunk:
+                return b''.join(chunks)
+
+            total += len(chunk)
+            check_decompressed(total <= max_length, max_length)
+            chunks.append(chunk)
+
+
+compressors = {
+    Compression.ZLIB: (zlib.compress, zlib_decompress),
+    Compression.LZMA: (lzma_compress, lzma_decompress),
+}
+
+if importlib.util.find_spec('lz4'):
+    compressors[Compression.LZ4] = (lz4_compress, lz4_decompress)
+
+if importlib.util.find_spec('zstandard'):
+    compressors[Compression.ZSTD] = (zstd_compress, zstd_decompress)
+
+
+COMPRESSION_PREFERENCE = [Compression.ZSTD, Compression.LZ4, Compression.ZLIB, Compression.LZMA]
+
+
+def supported_compression():
+    return [c.name for c in COMPRESSION_PREFERENCE if c in compressors]
+
+
+def get_fds(ancdata):
+    fds = array.array('i')
+    for level, type, data in ancdata:
+        if level == socket.SOL_SOCKET and type == socket.SCM_RIGHTS:
+            fds.frombytes(data[:len(data) - (len(data) % fds.itemsize)])
+
+    return list(fds)
+
+
+def get_ancdata(fds):
+    if not fds:
+        return None
+
+    return [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array('i', fds))]
+
+
+class MsgpackCodec(object):
+    def __init__(self, bufsize=65536, max_fds=16, compression=None, compression_threshold=65536,
+                 max_frame_size=MAX_FRAME_SIZE):
+        self.packer = Packer(default=default, use_bin_type=True)
+        self.max_frame_size = max_frame_size
+        self.discard = 0
+        self.error = None
+        self.anclength = socket.CMSG_SPACE(max_fds * array.array('i').itemsize)
+        self.recvbuf = bytearray(bufsize)
+        self.recvview = memoryview(self.recvbuf)
+        self.pending = bytearray()
+        self.offset = 0
+        self.fds = []
+        self.compression = Compression(compression or Compression.NONE)
+        self.compression_threshold = compression_threshold
+
+        if self.compression and self.compression not in compressors:
+            raise ValueError('Compression algorithm {0} is not available'.format(self.compression.name))
+
+    def negotiate(self, peer_compression):
+        self.compression = first_or_default(
+            lambda c: c in compressors and c.name in peer_compression,
+            COMPRESSION_PREFERENCE,
+            Compression.NONE
+        )
+
+        return self.compression
+
+    def frame_buffers(self, payload, nfds=0):
+        flags = 0
+        if self.compression and len(payload) >= self.compression_threshold:
+            compress, _ = compressors[self.compression]
+            payload = compress(payload)
+            flags |= self.compression
+
+        return [FRAME_HEADER.pack(len(payload), nfds, flags), payload]
+
+    def frame(self, payload, nfds=0):
+        return b''.join(self.frame_buffers(payload, nfds))
+
+    def encode(self, obj, nfds=0):
+        return self.frame(self.packer.pack(obj), nfds)
+
+    async def encode_buffers_async(self, obj, nfds=0, loop=None):
+        payload = self.packer.pack(obj)
+        if not self.compression or len(payload) < self.compression_threshold:
+            return self.frame_buffers(payload, nfds)
+
+        import asyncio
+
+        loop = loop or asyncio.get_event_loop()
+        return await loop.run_in_executor(None, self.frame_buffers, payload, nfds)
+
+    async def encode_async(self, obj, nfds=0, loop=None):
+        return b''.join(await self.encode_buffers_async(obj, nfds, loop))
+
+    def send(self, sock, obj, fds=None):
+        xsendmsgv(sock, self.frame_buffers(self.packer.pack(obj), len(fds or [])), get_ancdata(fds))
+
+    async def send_async(self, sock, obj, fds=None, loop=None):
+        buffers = await self.encode_buffers_async(obj, len(fds or []), loop)
+        await xsendmsgv_async(sock, buffers, get_ancdata(fds), loop)
+
+    def feed(self, data, fds=None):
+        if fds:
+            self.fds.extend(fds)
+
+        if self.discard:
+            skip = min(self.discard, len(data))
+            self.discard -= skip
+            data = data[skip:]
+
+        self.pending += data
+
+    def __iter__(self):
+        return self
+
+    def next_frame(self):
+        # Consumes the next complete frame and returns its location in the
+        # receive buffer, which stays valid until the following call
+        start = self.offset + FRAME_HEADER.size
+        if len(self.pending) < start:
+            self.compact()
+            raise StopIteration
+
+        length, nfds, flags = FRAME_HEADER.unpack_from(self.pending, self.offset)
+        if length > self.max_frame_size:
+            skip = min(length, len(self.pending) - start)
+            self.offset = start + skip
+            self.discard = length - skip
+            for fd in self.pop_fds(nfds):
+                os.close(fd)
+
+            raise ValueError('Frame of {0} bytes exceeds the limit of {1} bytes'.format(length, self.max_frame_size))
+
+        if len(self.pending) < start + length:
+            self.compact()
+            raise StopIteration
+
+        self.offset = start + length
+        return start, length, flags, self.pop_fds(nfds)
+
+    def pop_fds(self, nfds):
+        fds, self.fds = self.fds[:nfds], self.fds[nfds:]
+        return fds
+
+    def decode(self, payload, flags):
+        compression = flags & FRAME_COMPRESSION_MASK
+        if compression:
+            if compression not in compressors:
+                raise ValueError('Unsupported compression algorithm {0}'.format(compression))
+
+            _, decompress = compressors[compression]
+            payload = decompress(payload, self.max_frame_size)
+
+        return unpackb(payload, ext_hook=ext_hook, raw=False)
+
+    def decode_frame(self, start, length, flags, fds):
+        payload = memoryview(self.pending)[start:start + length]
+        try:
+            return self.decode(payload, flags), fds
+        except:
+            for fd in fds:
+                os.close(fd)
+            raise
+        finally:
+            payload.release()
+
+    def __next__(self):
+        return self.decode_frame(*self.next_frame())
+
+    def compact(self):
+        if self.offset:
+            del self.pending[:self.offset]
+            self.offset = 0
+
+    def recv_into(self, sock):
+        nbytes, ancdata, _, _ = sock.recvmsg_into([self.recvview], self.anclength)
+        if nbytes:
+            self.feed(self.recvview[:nbytes], get_fds(ancdata))
+
+        return nbytes
+
+    def drain(self):
+        # A frame that fails to decode does not take the frames decoded
+        # before it down with it; its error is raised on the next call
+        if self.error is not None:
+            err, self.error = self.error, None
+            raise err
+
+        result = []
+        while True:
+            try:
+                result.append(next(self))
+            except StopIteration:
+                return result
+            except Exception as err:
+                if not result:
+                    raise
+
+                self.error = err
+                return result
+
+    async def drain_async(self, loop):
+        if self.error is not None:
+            err, self.error = self.error, None
+            raise err
+
+        result = []
+        while True:
+            try:
+                start, length, flags, fds = self.next_frame()
+                if not flags & FRAME_COMPRESSION_MASK:
+                    result.append(self.decode_frame(start, length, flags, fds))
+                    continue
+
+                # Decompression of large frames must not stall the event loop
+                payload = bytes(self.pending[start:start + length])
+                try:
+                    obj = await loop.run_in_executor(None, self.decode, payload, flags)
+                except:
+                    for fd in fds:
+                        os.close(fd)
+                    raise
+
+                result.append((obj, fds))
+            except StopIteration:
+                return result
+            except Exception as err:
+                if not result:
+                    raise
+
+                self.error = err
+                return result
+
+    def recv_chunk(self, sock):
+        # Frames left over after an earlier decode error come first
+        result = self.drain()
+        if result:
+            return result
+
+        if not self.recv_into(sock):
+            return None
+
+        return self.drain()
+
+    def recv(self, sock):
+        while True:
+            try:
+                return self.recv_chunk(sock)
+            except InterruptedError:
+                continue
+
+    async def recv_async(self, sock, loop=None):
+        if sock.gettimeout() != 0:
+            raise ValueError('Socket must be in non-blocking mode')
+
+        import asyncio
+
+        loop = loop or asyncio.get_event_loop()
+        result = await self.drain_async(loop)
+        if result:
+            return result
+
+        while True:
+            try:
+                if not self.recv_into(sock):
+                    return None
+                break
+            except InterruptedError:
+                continue
+            except BlockingIOError:
+                await wait_socket(sock, False, loop)
+
+        return await self.drain_async(loop)
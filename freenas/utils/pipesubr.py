@@ -26,17 +26,42 @@
 #####################################################################
 
 from shlex import split as shlex_split
-from subprocess import Popen, PIPE
+from subprocess import Popen, PIPE, DEVNULL, TimeoutExpired
 from os import system as __system
+from freenas.utils import Histogram, xsendmsg, xrecvmsg
+import array
+import collections
+import contextlib
 import ctypes
+import errno
+import heapq
+import itertools
+import json
 import os
+import selectors
 import signal
+import socket
+import struct
+import sys
 import threading
+import time
 
 SIG_BLOCK = 1
 SIG_UNBLOCK = 2
 SIG_SETMASK = 3
 
+try:
+    MAXFD = os.sysconf('SC_OPEN_MAX')
+except (ValueError, OSError):
+    MAXFD = 1024
+
+# Spawn helper frame: payload length, number of passed file descriptors
+HELPER_FRAME = struct.Struct('<IH')
+HELPER_MAX_FDS = 3
+
+spawn_helper = None
+command_stats = None
+
 
 def unblock_sigchld():
     libc = ctypes.cdll.LoadLibrary("libc.so.7")
@@ -47,25 +72,187 @@ def unblock_sigchld():
     libc.sigprocmask(SIG_SETMASK, pmask, None)
 
 
+@contextlib.contextmanager
+def sigchld_unblocked():
+    # The signal mask is per-thread and inherited by the child across
+    # fork and exec, so there is no need to run Python code in the child
+    old = signal.pthread_sigmask(signal.SIG_UNBLOCK, [signal.SIGCHLD])
+    try:
+        yield
+    finally:
+        signal.pthread_sigmask(signal.SIG_SETMASK, old)
+
+
 def fastclose():
-    #FIXME: Take into account keep_fd and determine which fds from /dev/fd
-    # or fstat. See #10206
-    for fd in range(3, 1024):
+    # closerange() uses close_range(2)/closefrom(2) where available
+    os.closerange(3, MAXFD)
+
+
+class CommandStats(object):
+    def __init__(self, slow_threshold=None, max_samples=100):
+        self.slow_threshold = slow_threshold
+        self.lock = threading.Lock()
+        self.executables = {}
+        self.samples = collections.deque(maxlen=max_samples)
+
+    def record(self, args, wall, user, system, maxrss, returncode):
+        name = os.path.basename(args[0]) if args else ''
+        with self.lock:
+            entry = self.executables.get(name)
+            if not entry:
+                entry = self.executables[name] = {
+                    'failures': 0,
+                    'wall': Histogram(0.001),
+                    'user': Histogram(0.001),
+                    'system': Histogram(0.001),
+                    'maxrss': Histogram(1024)
+                }
+
+            if returncode != 0:
+                entry['failures'] += 1
+
+            entry['wall'].add(wall)
+            entry['user'].add(user)
+            entry['system'].add(system)
+            entry['maxrss'].add(maxrss)
+
+            if self.slow_threshold is not None and wall >= self.slow_threshold:
+                self.samples.append({
+                    'argv': list(args),
+                    'timestamp': time.time(),
+                    'wall': wall,
+                    'user': user,
+                    'system': system,
+                    'maxrss': maxrss,
+                    'returncode': returncode
+                })
+
+    def __getstate__(self):
+        with self.lock:
+            return {
+                'executables': {
+                    name: {
+                        'count': entry['wall'].count,
+                        'failures': entry['failures'],
+                        'wall': entry['wall'].__getstate__(),
+                        'user': entry['user'].__getstate__(),
+                        'system': entry['system'].__getstate__(),
+                        'maxrss': entry['maxrss'].__getstate__()
+                    }
+                    for name, entry in self.executables.items()
+                },
+                'slow': list(self.samples)
+            }
+
+
+class AccountedPopen(Popen):
+    # Reaps the child itself with os.wait4() through the public wait() and
+    # poll(), which communicate(), __exit__() and send_signal() go through
+    def __init__(self, args, *pargs, **kwargs):
+        self.started_at = time.monotonic()
+        self.rusage = None
+        self.reap_lock = threading.Lock()
+        super(AccountedPopen, self).__init__(args, *pargs, **kwargs)
+
+    def reap(self, options):
+        if not self.reap_lock.acquire(not options & os.WNOHANG):
+            return False
+
         try:
-            os.close(fd)
-        except OSError:
-            pass
+            if self.returncode is not None:
+                return True
+
+            try:
+                pid, status, rusage = os.wait4(self.pid, options)
+            except ChildProcessError:
+                # Reaped elsewhere (e.g. SIGCHLD set to SIG_IGN)
+                self.returncode = 0
+                return True
+
+            if not pid:
+                return False
+
+            self.rusage = rusage
+            self.returncode = exitcode(status)
+            if command_stats:
+                command_stats.record(
+                    self.args if isinstance(self.args, (list, tuple)) else [self.args],
+                    time.monotonic() - self.started_at,
+                    rusage.ru_utime,
+                    rusage.ru_stime,
+                    rusage.ru_maxrss,
+                    self.returncode
+                )
+
+            return True
+        finally:
+            self.reap_lock.release()
+
+    def poll(self):
+        self.reap(os.WNOHANG)
+        return self.returncode
+
+    def wait(self, timeout=None):
+        if timeout is None:
+            while not self.reap(0):
+                pass
+
+            return self.returncode
+
+        deadline = time.monotonic() + timeout
+        delay = 0.0005
+        while not self.reap(os.WNOHANG):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutExpired(self.args, timeout)
+
+            delay = min(delay * 2, remaining, 0.05)
+            time.sleep(delay)
 
+        return self.returncode
 
-def pipeopen(command, allowfork=False):
+
+def popen(args, **kwargs):
+    if command_stats:
+        return AccountedPopen(args, **kwargs)
+
+    return Popen(args, **kwargs)
+
+
+def enable_accounting(slow_threshold=None, max_samples=100):
+    global command_stats
+    command_stats = CommandStats(slow_threshold, max_samples)
+    return command_stats
+
+
+def disable_accounting():
+    global command_stats
+    command_stats = None
+
+
+def get_command_stats():
+    return command_stats.__getstate__() if command_stats else None
+
+
+def pipeopen(command, allowfork=False, spawn=True):
     args = shlex_split(str(command))
 
-    preexec_fn = fastclose
-    if allowfork:
-        preexec_fn = lambda : (fastclose(), unblock_sigchld())
+    if spawn and spawn_helper and spawn_helper.alive:
+        return spawn_helper.popen(args, allowfork)
+
+    if not spawn:
+        preexec_fn = fastclose
+        if allowfork:
+            preexec_fn = lambda : (fastclose(), unblock_sigchld())
 
-    return Popen(args, stdin=PIPE, stdout=PIPE, stderr=PIPE,
-        close_fds=False, preexec_fn=preexec_fn)
+        return popen(args, stdin=PIPE, stdout=PIPE, stderr=PIPE,
+            close_fds=False, preexec_fn=preexec_fn)
+
+    # Without preexec_fn no Python code runs in the forked child and
+    # descriptors are closed in C. This is still a regular fork() on
+    # FreeBSD; only Linux builds of CPython may use vfork() here
+    with sigchld_unblocked() if allowfork else contextlib.suppress():
+        return popen(args, stdin=PIPE, stdout=PIPE, stderr=PIPE, close_fds=True)
 
 
 class Command(object):
@@ -98,7 +285,336 @@ class Command(object):
         return (self.returncode, self.stdout, self.stderr)
 
 
-def run(command, allowfork=False, timeout=-1):
+class StreamingCommand(Command):
+    def __init__(self, command, bufsize=65536, encoding='utf-8', max_stderr=65536):
+        super(StreamingCommand, self).__init__(command)
+        self.bufsize = bufsize
+        self.encoding = encoding
+        self.max_stderr = max_stderr
+
+    def lines(self, allowfork=False, timeout=None):
+        self.process = pipeopen(self.command, allowfork)
+        self.process.stdin.close()
+        stdout, stderr = self.process.stdout, self.process.stderr
+        buffer = bytearray(self.bufsize)
+        view = memoryview(buffer)
+        pending = bytearray()
+        errors = bytearray()
+        deadline = time.monotonic() + timeout if timeout else None
+        selector = selectors.DefaultSelector()
+
+        for pipe in (stdout, stderr):
+            os.set_blocking(pipe.fileno(), False)
+            selector.register(pipe, selectors.EVENT_READ)
+
+        try:
+            while selector.get_map():
+                remaining = None
+                if deadline:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutExpired(self.command, timeout)
+
+                for key, _ in selector.select(remaining):
+                    pipe = key.fileobj
+                    try:
+                        nbytes = os.readv(pipe.fileno(), [buffer])
+                    except BlockingIOError:
+                        continue
+
+                    if not nbytes:
+                        selector.unregister(pipe)
+                        continue
+
+                    if pipe is stderr:
+                        errors += view[:nbytes]
+                        del errors[:-self.max_stderr]
+                        continue
+
+                    pending += view[:nbytes]
+                    start = 0
+                    while True:
+                        end = pending.find(b'\n', start)
+                        if end == -1:
+                            break
+
+                        yield pending[start:end].decode(self.encoding, 'replace')
+                        start = end + 1
+
+                    del pending[:start]
+
+            if pending:
+                yield pending.decode(self.encoding, 'replace')
+
+            self.process.wait()
+        finally:
+            selector.close()
+            if self.process.poll() is None:
+                self.process.terminate()
+                self.process.wait()
+
+            stdout.close()
+            stderr.close()
+            self.stderr = bytes(errors)
+
+    def records(self, fields=None, separator='\t', allowfork=False, timeout=None):
+        for line in self.lines(allowfork, timeout):
+            values = line.split(separator)
+            yield dict(zip(fields, values)) if fields else values
+
+
+def iter_lines(command, allowfork=False, timeout=None, **kwargs):
+    return StreamingCommand(command, **kwargs).lines(allowfork, timeout)
+
+
+def iter_records(command, fields=None, separator='\t', allowfork=False, timeout=None, **kwargs):
+    return StreamingCommand(command, **kwargs).records(fields, separator, allowfork, timeout)
+
+
+class Pipeline(object):
+    def __init__(self, commands, stdin=None, stdout=None, splice=False, bufsize=65536, max_stderr=65536):
+        self.commands = [shlex_split(c) if isinstance(c, str) else list(c) for c in commands]
+        self.input = stdin
+        self.output = stdout
+        self.splice = splice and stdout is not None
+        self.use_splice = hasattr(os, 'splice')
+        self.bufsize = bufsize
+        self.max_stderr = max_stderr
+        self.buffer = bytearray(bufsize)
+        self.processes = []
+        self.stdout = None
+        self.stderr = []
+        self.transferred = 0
+        self.timed_out = False
+
+    @property
+    def returncodes(self):
+        return [p.returncode for p in self.processes]
+
+    def start(self, allowfork=False):
+        stdin = DEVNULL if self.input is None else self.input
+        last = len(self.commands) - 1
+
+        with sigchld_unblocked() if allowfork else contextlib.suppress():
+            for i, args in enumerate(self.commands):
+                stdout = PIPE
+                if i == last and self.output is not None and not self.splice:
+                    stdout = self.output
+
+                try:
+                    proc = popen(args, stdin=stdin, stdout=stdout, stderr=PIPE, close_fds=True)
+                finally:
+                    # Only the next stage may hold the read end, otherwise
+                    # SIGPIPE/EOF would never propagate along the pipeline
+                    if i > 0:
+                        stdin.close()
+
+                self.processes.append(proc)
+                if i != last:
+                    stdin = proc.stdout
+
+    def transfer(self, fd):
+        # The output descriptor is expected to be in blocking mode;
+        # BlockingIOError is only meaningful for our end of the pipe
+        output = self.output if isinstance(self.output, int) else self.output.fileno()
+        if self.use_splice:
+            try:
+                return os.splice(fd, output, self.bufsize, flags=os.SPLICE_F_MOVE)
+            except OSError as err:
+                if err.errno != errno.EINVAL:
+                    raise
+
+                self.use_splice = False
+
+        nbytes = os.readv(fd, [self.buffer])
+        view = memoryview(self.buffer)[:nbytes]
+        while view:
+            view = view[os.write(output, view):]
+
+        return nbytes
+
+    def run(self, allowfork=False, timeout=None):
+        deadline = time.monotonic() + timeout if timeout else None
+        remaining = lambda: max(deadline - time.monotonic(), 0) if deadline else None
+        selector = selectors.DefaultSelector()
+        errors = collections.OrderedDict()
+        output = []
+
+        try:
+            self.start(allowfork)
+            stdout = self.processes[-1].stdout
+            for pipe in [p.stderr for p in self.processes] + [stdout]:
+                if pipe:
+                    os.set_blocking(pipe.fileno(), False)
+                    selector.register(pipe, selectors.EVENT_READ)
+
+            for proc in self.processes:
+                errors[proc.stderr] = bytearray()
+
+            while selector.get_map():
+                timeout = remaining()
+                if timeout == 0:
+                    self.timed_out = True
+                    break
+
+                for key, _ in selector.select(timeout):
+                    pipe = key.fileobj
+                    try:
+                        if pipe is stdout and self.splice:
+                            nbytes = self.transfer(pipe.fileno())
+                        else:
+                            nbytes = os.readv(pipe.fileno(), [self.buffer])
+                    except BlockingIOError:
+                        continue
+
+                    if not nbytes:
+                        selector.unregister(pipe)
+                        continue
+
+                    if pipe is stdout:
+                        self.transferred += nbytes
+                        if not self.splice:
+                            output.append(bytes(self.buffer[:nbytes]))
+                        continue
+
+                    err = errors[pipe]
+                    err += self.buffer[:nbytes]
+                    del err[:-self.max_stderr]
+
+            for proc in self.processes:
+                if self.timed_out:
+                    break
+
+                try:
+                    proc.wait(remaining())
+                except TimeoutExpired:
+                    self.timed_out = True
+        finally:
+            selector.close()
+            for proc in self.processes:
+                if proc.poll() is None:
+                    proc.terminate()
+                    proc.wait()
+
+                for pipe in (proc.stdout, proc.stderr):
+                    if pipe:
+                        pipe.close()
+
+        self.stdout = b''.join(output) if self.output is None else None
+        self.stderr = [bytes(e) for e in errors.values()]
+        return (self.returncodes, self.stdout, self.stderr)
+
+
+def pipeline(commands, allowfork=False, timeout=-1, stdin=None, stdout=None, splice=False):
+    try:
+        timeout = float(timeout)
+    except:
+        timeout = 0
+
+    p = Pipeline(commands, stdin, stdout, splice)
+    return p.run(allowfork, timeout if timeout > 0 else None)
+
+
+class CommandCache(object):
+    def __init__(self, ttl=5, cache_errors=False, max_entries=1024):
+        self.ttl = ttl
+        self.cache_errors = cache_errors
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def key(command):
+        return tuple(shlex_split(str(command)))
+
+    def run(self, command, allowfork=False, timeout=-1, ttl=None):
+        from concurrent.futures import Future
+
+        key = self.key(command)
+        ttl = self.ttl if ttl is None else ttl
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                self.hits += 1
+                return entry[1]
+
+            leader = False
+            flight = self.inflight.get(key)
+            if flight:
+                self.coalesced += 1
+            else:
+                flight = Future()
+                self.inflight[key] = flight
+                self.misses += 1
+                leader = True
+
+        if not leader:
+            return flight.result()
+
+        try:
+            result = run(command, allowfork, timeout)
+        except BaseException as err:
+            with self.lock:
+                del self.inflight[key]
+
+            flight.set_exception(err)
+            raise
+
+        with self.lock:
+            del self.inflight[key]
+            if ttl > 0 and (result[0] == 0 or self.cache_errors):
+                if len(self.entries) >= self.max_entries:
+                    self.purge()
+
+                self.entries[key] = (time.monotonic() + ttl, result)
+
+        flight.set_result(result)
+        return result
+
+    def purge(self):
+        now = time.monotonic()
+        for key, (expires, _) in list(self.entries.items()):
+            if expires <= now:
+                del self.entries[key]
+
+        while len(self.entries) >= self.max_entries:
+            del self.entries[next(iter(self.entries))]
+
+    def invalidate(self, command=None, predicate=None):
+        with self.lock:
+            if command is None and predicate is None:
+                self.entries.clear()
+                return
+
+            if command is not None:
+                self.entries.pop(self.key(command), None)
+
+            if predicate is not None:
+                for key in [k for k in self.entries if predicate(k)]:
+                    del self.entries[key]
+
+    def __getstate__(self):
+        return {
+            'entries': len(self.entries),
+            'inflight': len(self.inflight),
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced
+        }
+
+
+command_cache = CommandCache()
+
+
+def run(command, allowfork=False, timeout=-1, cache=None):
+    if cache:
+        return (command_cache if cache is True else cache).run(command, allowfork, timeout)
+
     try:
         timeout = float(timeout)
     except:
@@ -109,3 +625,457 @@ def run(command, allowfork=False, timeout=-1):
 
     c = Command(command)
     return c.run(allowfork, timeout)
+
+
+class CommandPool(object):
+    # How often processes that closed their pipes are polled for exit status
+    REAP_INTERVAL = 0.05
+
+    def __init__(self, max_running=16, allowfork=False):
+        self.max_running = max_running
+        self.allowfork = allowfork
+        self.selector = selectors.DefaultSelector()
+        self.pending = collections.deque()
+        self.running = set()
+        self.reaping = set()
+        self.timers = []
+        self.seq = itertools.count()
+
+    def submit(self, command, timeout=None, key=None):
+        self.pending.append((Command(command), timeout, command if key is None else key))
+
+    def start(self, cmd, timeout, key):
+        cmd.process = pipeopen(cmd.command, self.allowfork)
+        cmd.process.stdin.close()
+        cmd.key = key
+        cmd.buffers = {}
+        cmd.open_pipes = 0
+
+        for pipe in (cmd.process.stdout, cmd.process.stderr):
+            os.set_blocking(pipe.fileno(), False)
+            cmd.buffers[pipe] = []
+            cmd.open_pipes += 1
+            self.selector.register(pipe, selectors.EVENT_READ, cmd)
+
+        if timeout:
+            heapq.heappush(self.timers, (time.monotonic() + timeout, next(self.seq), cmd))
+
+        self.running.add(cmd)
+
+    def read(self, pipe, cmd):
+        try:
+            data = os.read(pipe.fileno(), 65536)
+        except BlockingIOError:
+            return
+
+        if data:
+            cmd.buffers[pipe].append(data)
+            return
+
+        self.selector.unregister(pipe)
+        pipe.close()
+        cmd.open_pipes -= 1
+        if not cmd.open_pipes:
+            self.running.discard(cmd)
+            self.reaping.add(cmd)
+
+    def reap(self):
+        for cmd in list(self.reaping):
+            if cmd.process.poll() is None:
+                continue
+
+            self.reaping.discard(cmd)
+            cmd.stdout = b''.join(cmd.buffers[cmd.process.stdout])
+            cmd.stderr = b''.join(cmd.buffers[cmd.process.stderr])
+            yield cmd.key, cmd.returncode, cmd.stdout, cmd.stderr
+
+    def expire(self):
+        now = time.monotonic()
+        while self.timers and self.timers[0][0] <= now:
+            _, _, cmd = heapq.heappop(self.timers)
+            if cmd.process.returncode is None:
+                cmd.process.terminate()
+
+    def results(self):
+        try:
+            while self.pending or self.running or self.reaping:
+                while self.pending and len(self.running) + len(self.reaping) < self.max_running:
+                    cmd, timeout, key = self.pending.popleft()
+                    try:
+                        self.start(cmd, timeout, key)
+                    except OSError:
+                        # Same result run() gives for a command that can't be spawned
+                        yield key, -1, None, None
+
+                timeout = None
+                if self.reaping:
+                    timeout = self.REAP_INTERVAL
+
+                if self.timers:
+                    remaining = max(self.timers[0][0] - time.monotonic(), 0)
+                    timeout = remaining if timeout is None else min(timeout, remaining)
+
+                if self.running:
+                    for key, _ in self.selector.select(timeout):
+                        self.read(key.fileobj, key.data)
+                elif timeout:
+                    time.sleep(timeout)
+
+                self.expire()
+                yield from self.reap()
+        finally:
+            for cmd in self.running | self.reaping:
+                if cmd.process.poll() is None:
+                    cmd.process.kill()
+                    cmd.process.wait()
+
+            self.selector.close()
+
+
+def run_many(commands, max_running=16, allowfork=False, timeout=-1):
+    try:
+        timeout = float(timeout)
+    except:
+        timeout = 0
+
+    pool = CommandPool(max_running, allowfork)
+    for c in commands:
+        pool.submit(c, timeout if timeout > 0 else None)
+
+    return pool.results()
+
+
+def send_frame(sock, obj, fds=None):
+    payload = json.dumps(obj).encode('utf-8')
+    ancdata = None
+    if fds:
+        ancdata = [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array('i', fds))]
+
+    xsendmsg(sock, HELPER_FRAME.pack(len(payload), len(fds or [])) + payload, ancdata)
+
+
+def recv_frame(sock):
+    fds = array.array('i')
+    header, ancdata = xrecvmsg(sock, HELPER_FRAME.size, socket.CMSG_SPACE(HELPER_MAX_FDS * fds.itemsize))
+    for level, type, data in ancdata:
+        if level == socket.SOL_SOCKET and type == socket.SCM_RIGHTS:
+            fds.frombytes(data[:len(data) - (len(data) % fds.itemsize)])
+
+    if len(header) < HELPER_FRAME.size:
+        for fd in fds:
+            os.close(fd)
+
+        return None, []
+
+    length, _ = HELPER_FRAME.unpack(header)
+    payload, _ = xrecvmsg(sock, length)
+    return json.loads(payload.decode('utf-8')), list(fds)
+
+
+def exitcode(status):
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+
+    return os.WEXITSTATUS(status)
+
+
+def spawn_helper_main(fd):
+    # Runs in the helper process: spawns requested commands on the passed
+    # descriptors, replies with pid and later with the exit status
+    sock = socket.socket(fileno=fd)
+    selector = selectors.DefaultSelector()
+    wakeup_r, wakeup_w = os.pipe()
+    children = {}
+
+    for i in (wakeup_r, wakeup_w):
+        os.set_blocking(i, False)
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGCHLD, lambda signo, frame: None)
+    signal.set_wakeup_fd(wakeup_w)
+    signal.pthread_sigmask(signal.SIG_UNBLOCK, [signal.SIGCHLD])
+    selector.register(sock, selectors.EVENT_READ)
+    selector.register(wakeup_r, selectors.EVENT_READ)
+
+    while True:
+        for key, _ in selector.select():
+            if key.fileobj is sock:
+                request, fds = recv_frame(sock)
+                if request is None:
+                    return
+
+                try:
+                    # Children get the caller's signal mask, as they would
+                    # when spawned directly; the helper itself keeps SIGCHLD
+                    old = signal.pthread_sigmask(signal.SIG_SETMASK, request['sigmask'])
+                    try:
+                        proc = Popen(request['args'], stdin=fds[0], stdout=fds[1], stderr=fds[2], close_fds=True)
+                    finally:
+                        signal.pthread_sigmask(signal.SIG_SETMASK, old)
+                except (OSError, ValueError, IndexError) as err:
+                    send_frame(sock, {
+                        'id': request['id'],
+                        'errno': getattr(err, 'errno', None) or errno.EINVAL,
+                        'error': getattr(err, 'strerror', None) or str(err),
+                        'filename': getattr(err, 'filename', None)
+                    })
+                else:
+                    children[proc.pid] = (request['id'], proc, time.monotonic())
+                    send_frame(sock, {'id': request['id'], 'pid': proc.pid})
+                finally:
+                    for i in fds:
+                        os.close(i)
+
+                continue
+
+            try:
+                while os.read(wakeup_r, 512):
+                    pass
+            except BlockingIOError:
+                pass
+
+            while children:
+                try:
+                    pid, status, rusage = os.wait4(-1, os.WNOHANG)
+                except ChildProcessError:
+                    break
+
+                if not pid:
+                    break
+
+                id, proc, started_at = children.pop(pid)
+                proc.returncode = exitcode(status)
+                send_frame(sock, {
+                    'id': id,
+                    'returncode': proc.returncode,
+                    'wall': time.monotonic() - started_at,
+                    'rusage': [rusage.ru_utime, rusage.ru_stime, rusage.ru_maxrss]
+                })
+
+
+class HelperProcess(object):
+    def __init__(self, args):
+        self.args = args
+        self.pid = None
+        self.returncode = None
+        self.error = None
+        self.stdin = None
+        self.stdout = None
+        self.stderr = None
+        self.started = threading.Event()
+        self.finished = threading.Event()
+
+    def poll(self):
+        return self.returncode
+
+    def wait(self, timeout=None):
+        if not self.finished.wait(timeout):
+            raise TimeoutExpired(self.args, timeout)
+
+        return self.returncode
+
+    def send_signal(self, sig):
+        if self.returncode is None:
+            with contextlib.suppress(ProcessLookupError):
+                os.kill(self.pid, sig)
+
+    def terminate(self):
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self):
+        self.send_signal(signal.SIGKILL)
+
+    def communicate(self, input=None, timeout=None):
+        deadline = time.monotonic() + timeout if timeout else None
+        output = {}
+        selector = selectors.DefaultSelector()
+
+        if self.stdin:
+            try:
+                if input:
+                    self.stdin.write(input)
+                self.stdin.close()
+            except BrokenPipeError:
+                pass
+
+        for pipe in (self.stdout, self.stderr):
+            if pipe:
+                output[pipe] = []
+                selector.register(pipe, selectors.EVENT_READ)
+
+        try:
+            while selector.get_map():
+                remaining = None
+                if deadline:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutExpired(self.args, timeout)
+
+                for key, _ in selector.select(remaining):
+                    data = os.read(key.fileobj.fileno(), 65536)
+                    if not data:
+                        selector.unregister(key.fileobj)
+                        key.fileobj.close()
+                        continue
+
+                    output[key.fileobj].append(data)
+        finally:
+            selector.close()
+
+        self.wait(max(deadline - time.monotonic(), 0) if deadline else None)
+        return tuple(b''.join(output[p]) if p else None for p in (self.stdout, self.stderr))
+
+
+class SpawnHelper(object):
+    def __init__(self):
+        self.sock = None
+        self.process = None
+        self.thread = None
+        self.alive = False
+        self.lock = threading.Lock()
+        self.send_lock = threading.Lock()
+        self.requests = {}
+        self.seq = itertools.count(1)
+
+    def start(self):
+        parent, child = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.process = Popen(
+            [
+                sys.executable, '-c',
+                'import sys; from freenas.utils.pipesubr import spawn_helper_main; '
+                'spawn_helper_main(int(sys.argv[1]))',
+                str(child.fileno())
+            ],
+            stdin=DEVNULL, pass_fds=[child.fileno()], close_fds=True
+        )
+
+        child.close()
+        self.sock = parent
+        self.alive = True
+        self.thread = threading.Thread(target=self.reader, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.alive = False
+        if self.sock:
+            self.sock.shutdown(socket.SHUT_RDWR)
+            self.thread.join()
+            self.sock.close()
+            self.process.wait()
+
+    def spawn(self, args, stdin, stdout, stderr, allowfork=False):
+        proc = HelperProcess(args)
+        sigmask = signal.pthread_sigmask(signal.SIG_BLOCK, [])
+        if allowfork:
+            sigmask.discard(signal.SIGCHLD)
+
+        with self.lock:
+            if not self.alive:
+                raise OSError(errno.EPIPE, 'Spawn helper is not running')
+
+            id = next(self.seq)
+            self.requests[id] = proc
+
+        # Sending must not hold self.lock: the reader needs it to consume
+        # replies, and the helper stops reading requests while its replies
+        # are not being consumed
+        try:
+            with self.send_lock:
+                send_frame(self.sock, {
+                    'id': id,
+                    'args': args,
+                    'sigmask': [int(s) for s in sigmask]
+                }, [stdin, stdout, stderr])
+        except OSError:
+            with self.lock:
+                self.requests.pop(id, None)
+            raise
+
+        proc.started.wait()
+        if proc.error:
+            raise OSError(*proc.error)
+
+        return proc
+
+    def popen(self, args, allowfork=False):
+        pipes = [os.pipe() for _ in range(3)]
+        try:
+            proc = self.spawn(args, pipes[0][0], pipes[1][1], pipes[2][1], allowfork)
+        except:
+            for r, w in pipes:
+                os.close(r)
+                os.close(w)
+            raise
+
+        os.close(pipes[0][0])
+        os.close(pipes[1][1])
+        os.close(pipes[2][1])
+        proc.stdin = open(pipes[0][1], 'wb')
+        proc.stdout = open(pipes[1][0], 'rb')
+        proc.stderr = open(pipes[2][0], 'rb')
+        return proc
+
+    def reader(self):
+        try:
+            while True:
+                try:
+                    msg, _ = recv_frame(self.sock)
+                except OSError:
+                    break
+
+                if msg is None:
+                    break
+
+                with self.lock:
+                    proc = self.requests.get(msg['id'])
+                    if 'pid' not in msg:
+                        self.requests.pop(msg['id'], None)
+
+                if not proc:
+                    continue
+
+                if 'pid' in msg:
+                    proc.pid = msg['pid']
+                    proc.started.set()
+                elif 'error' in msg:
+                    proc.error = (msg['errno'], msg['error'], msg['filename'])
+                    proc.started.set()
+                    proc.finished.set()
+                else:
+                    if command_stats:
+                        command_stats.record(proc.args, msg['wall'], *msg['rusage'], msg['returncode'])
+
+                    proc.returncode = msg['returncode']
+                    proc.finished.set()
+        finally:
+            with self.lock:
+                self.alive = False
+                requests, self.requests = self.requests, {}
+
+            for proc in requests.values():
+                if not proc.started.is_set():
+                    proc.error = (errno.EPIPE, 'Spawn helper exited')
+                    proc.started.set()
+
+                if proc.returncode is None:
+                    proc.returncode = -1
+
+                proc.finished.set()
+
+
+def start_spawn_helper():
+    global spawn_helper
+
+    if not spawn_helper or not spawn_helper.alive:
+        spawn_helper = SpawnHelper()
+        spawn_helper.start()
+
+    return spawn_helper
+
+
+def stop_spawn_helper():
+    global spawn_helper
+
+    if spawn_helper:
+        spawn_helper.stop()
+        spawn_helper = None
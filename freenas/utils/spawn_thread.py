@@ -25,8 +25,19 @@
 #
 #####################################################################
 
+import collections
+import functools
+import sys
 import threading
 import logging
+import time
+from freenas.utils import Histogram
+
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+PRIORITY_NAMES = ('high', 'normal', 'low')
 
 
 def gevent_monkey_patched():
@@ -40,35 +51,347 @@ def gevent_monkey_patched():
 
 def wrapper(fn, *args, **kwargs):
     try:
-        fn(*args, **kwargs)
+        return fn(*args, **kwargs)
     except:
         logging.exception('Exception in thread {0}'.format(threading.current_thread().name))
         raise
 
 
+async def async_wrapper(coro):
+    import asyncio
+
+    try:
+        return await coro
+    except asyncio.CancelledError:
+        raise
+    except:
+        logging.exception('Exception in task {0}'.format(getattr(coro, '__qualname__', coro)))
+        raise
+
+
+async def run_in_executor(loop, executor, fn, *args, **kwargs):
+    return await loop.run_in_executor(executor, functools.partial(wrapper, fn, *args, **kwargs))
+
+
+class ThreadPool(object):
+    def __init__(self, name, size=10, max_queue=0, reject=False):
+        self.name = name
+        self.size = size
+        self.max_queue = max_queue
+        self.reject = reject
+        self.lanes = [collections.deque() for _ in PRIORITY_NAMES]
+        self.queued = 0
+        self.lock = threading.Lock()
+        self.not_empty = threading.Condition(self.lock)
+        self.not_full = threading.Condition(self.lock)
+        self.threads = set()
+        self.idle = 0
+        self.active = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.wait_time = Histogram(0.0001)
+        self.run_time = Histogram(0.0001)
+        self.shutting_down = False
+        self.seq = 0
+
+    def submit(self, fn, *args, **kwargs):
+        return self.submit_priority(PRIORITY_NORMAL, fn, *args, **kwargs)
+
+    def submit_priority(self, priority, fn, *args, **kwargs):
+        from concurrent.futures import Future
+
+        future = Future()
+        with self.lock:
+            if self.max_queue and self.queued >= self.max_queue:
+                if self.reject:
+                    self.rejected += 1
+                    raise RuntimeError('Thread pool {0} queue is full'.format(self.name))
+
+                while self.queued >= self.max_queue and not self.shutting_down:
+                    self.not_full.wait()
+
+            if self.shutting_down:
+                raise RuntimeError('Thread pool {0} is shut down'.format(self.name))
+
+            self.lanes[priority].append((future, fn, args, kwargs, time.monotonic()))
+            self.queued += 1
+            self.submitted += 1
+
+            if self.idle < self.queued and len(self.threads) < self.size:
+                self.seq += 1
+                t = threading.Thread(target=self.worker, name='{0}-{1}'.format(self.name, self.seq), daemon=True)
+                self.threads.add(t)
+                t.start()
+
+            self.not_empty.notify()
+
+        return future
+
+    def worker(self):
+        while True:
+            with self.lock:
+                while not self.queued and not self.shutting_down:
+                    self.idle += 1
+                    self.not_empty.wait()
+                    self.idle -= 1
+
+                if not self.queued:
+                    self.threads.discard(threading.current_thread())
+                    return
+
+                lane = next(l for l in self.lanes if l)
+                future, fn, args, kwargs, enqueued_at = lane.popleft()
+                self.queued -= 1
+                self.not_full.notify()
+
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            started_at = time.monotonic()
+            with self.lock:
+                self.active += 1
+                self.wait_time.add(started_at - enqueued_at)
+
+            failed = False
+            try:
+                result = wrapper(fn, *args, **kwargs)
+            except BaseException as err:
+                failed = True
+                future.set_exception(err)
+            else:
+                future.set_result(result)
+            finally:
+                with self.lock:
+                    self.active -= 1
+                    self.completed += 1
+                    self.failed += failed
+                    self.run_time.add(time.monotonic() - started_at)
+
+    def shutdown(self, wait=True):
+        with self.lock:
+            self.shutting_down = True
+            self.not_empty.notify_all()
+            self.not_full.notify_all()
+            threads = list(self.threads)
+
+        if wait:
+            for t in threads:
+                t.join()
+
+    def __getstate__(self):
+        with self.lock:
+            return {
+                'name': self.name,
+                'size': self.size,
+                'max_queue': self.max_queue,
+                'threads': len(self.threads),
+                'active': self.active,
+                'idle': self.idle,
+                'queued': self.queued,
+                'lanes': {n: len(l) for n, l in zip(PRIORITY_NAMES, self.lanes)},
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'failed': self.failed,
+                'rejected': self.rejected,
+                'wait_time': self.wait_time.__getstate__(),
+                'run_time': self.run_time.__getstate__()
+            }
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def configure_pool(name, size=10, max_queue=0, reject=False):
+    with _pools_lock:
+        pool = _pools.get(name)
+        if not pool:
+            pool = _pools[name] = ThreadPool(name, size, max_queue, reject)
+            return pool
+
+    with pool.lock:
+        pool.size = size
+        pool.max_queue = max_queue
+        pool.reject = reject
+        pool.not_full.notify_all()
+
+    return pool
+
+
+def get_pool(name='default'):
+    with _pools_lock:
+        pool = _pools.get(name)
+        if not pool:
+            pool = _pools[name] = ThreadPool(name)
+
+        return pool
+
+
+def pool_stats():
+    with _pools_lock:
+        pools = list(_pools.values())
+
+    return {p.name: p.__getstate__() for p in pools}
+
+
 if not gevent_monkey_patched():
-    from concurrent.futures import ThreadPoolExecutor
-    _thread_pool = ThreadPoolExecutor(10)
     _gevent = False
 else:
     import gevent
     _gevent = True
 
+_asyncio_loop = None
+
+
+def set_asyncio_loop(loop):
+    global _asyncio_loop
+    _asyncio_loop = loop
+
+
+def running_loop():
+    # Checking sys.modules avoids importing asyncio in services not using it
+    asyncio = sys.modules.get('asyncio')
+    if not asyncio:
+        return None
+
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+def create_task(loop, coro, inner=None):
+    task = loop.create_task(coro)
+    if inner is not None:
+        # Done callbacks run on the loop, once the wrapper has finished;
+        # closing is a no-op unless the task was cancelled before it
+        # started, in which case the coroutine was never awaited
+        task.add_done_callback(lambda t: inner.close())
+
+    return task
+
+
+def schedule_task(loop, coro, inner=None):
+    from concurrent.futures import Future
+
+    future = Future()
+    tasks = []
+
+    def start():
+        if future.cancelled():
+            coro.close()
+            if inner is not None:
+                inner.close()
+            return
+
+        task = create_task(loop, coro, inner)
+        task.add_done_callback(finish)
+        tasks.append(task)
+
+    def finish(task):
+        if task.cancelled():
+            future.cancel()
+            return
+
+        if not future.set_running_or_notify_cancel():
+            return
+
+        if task.exception() is not None:
+            future.set_exception(task.exception())
+        else:
+            future.set_result(task.result())
+
+    def cancel(f):
+        # Runs after start(), which was queued first
+        if f.cancelled():
+            loop.call_soon_threadsafe(lambda: tasks and tasks[0].cancel())
+
+    future.add_done_callback(cancel)
+    loop.call_soon_threadsafe(start)
+    return future
+
+
+def spawn_task(loop, fn, *args, **kwargs):
+    import asyncio
+
+    executor = kwargs.pop('threadpool', None)
+    priority = kwargs.pop('priority', PRIORITY_NORMAL)
+    if executor is True:
+        executor = None
+    elif executor and not isinstance(executor, ThreadPool):
+        executor = get_pool(executor)
+
+    inner = None
+    if asyncio.iscoroutine(fn):
+        inner = fn
+    elif asyncio.iscoroutinefunction(fn):
+        inner = fn(*args, **kwargs)
+
+    if inner is None and executor is not None:
+        # ThreadPool workers already apply wrapper(); submitting directly
+        # also keeps the priority lane
+        future = executor.submit_priority(priority, fn, *args, **kwargs)
+        if running_loop() is loop:
+            return asyncio.wrap_future(future, loop=loop)
+
+        return future
+
+    if inner is not None:
+        coro = async_wrapper(inner)
+    else:
+        coro = run_in_executor(loop, executor, fn, *args, **kwargs)
+
+    if running_loop() is loop:
+        return create_task(loop, coro, inner)
+
+    return schedule_task(loop, coro, inner)
+
 
 def spawn_thread(*args, **kwargs):
+    # Blocking callables only go to an executor when a pool was asked for;
+    # otherwise they keep getting a dedicated thread, as long-running loops
+    # would starve the loop's bounded default executor
+    loop = _asyncio_loop or running_loop()
+    if loop:
+        import asyncio
+
+        fn = args[0]
+        if asyncio.iscoroutine(fn) or asyncio.iscoroutinefunction(fn) or kwargs.get('threadpool'):
+            return spawn_task(loop, *args, **kwargs)
+
     if _gevent:
         kwargs.pop('threadpool', None)
+        kwargs.pop('priority', None)
         return gevent.spawn(*args, **kwargs)
 
-    if kwargs.pop('threadpool', None):
-        return _thread_pool.submit(wrapper, *args, **kwargs)
+    threadpool = kwargs.pop('threadpool', None)
+    priority = kwargs.pop('priority', PRIORITY_NORMAL)
+    if threadpool:
+        if not isinstance(threadpool, ThreadPool):
+            threadpool = get_pool('default' if threadpool is True else threadpool)
 
-    t = threading.Thread(target=wrapper, args=args, daemon=True)
+        return threadpool.submit_priority(priority, *args, **kwargs)
+
+    t = threading.Thread(target=wrapper, args=args, kwargs=kwargs, daemon=True)
     t.start()
     return t
 
 
 def kill_thread(td):
+    from concurrent.futures import Future
+
+    asyncio = sys.modules.get('asyncio')
+    if asyncio and asyncio.isfuture(td):
+        td.cancel()
+        return
+
+    # Futures of coroutines scheduled from another thread, or pool tasks
+    # that have not started yet
+    if isinstance(td, Future) and (td.cancel() or td.done()):
+        return
+
     if not _gevent:
         raise RuntimeError('Unkillable thread')
 
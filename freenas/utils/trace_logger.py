@@ -27,6 +27,8 @@
 
 import os
 import io
+import functools
+import itertools
 import logging
 import traceback
 
@@ -35,30 +37,59 @@ _srcfile = __file__
 TRACE = logging.DEBUG-5
 
 
+# Keyed on the filename string rather than the code object, so the cache
+# does not keep code of unloaded modules alive
+@functools.lru_cache(maxsize=1024)
+def is_internal_file(filename):
+    return os.path.normcase(filename) in (logging._srcfile, _srcfile)
+
+
+def is_internal_code(co):
+    return is_internal_file(co.co_filename)
+
+
 class TraceLogger(logging.Logger):
+    # Set to False to skip frame walking and log "(unknown file)" instead
+    caller_info = True
+    # Emit only every n-th TRACE record
+    trace_sampling = 1
+
     def __init__(self, name):
         logging.Logger.__init__(self, name)
         logging.addLevelName(TRACE, 'TRACE')
+        self.trace_counter = itertools.count()
         return
 
     def trace(self, msg, *args, **kwargs):
-        self.log(TRACE, msg, *args, **kwargs)
+        if not self.isEnabledFor(TRACE):
+            return
+
+        if self.trace_sampling > 1 and next(self.trace_counter) % self.trace_sampling:
+            return
 
-    def findCaller(self, stack_info=False):
+        self._log(TRACE, msg, args, **kwargs)
+
+    def findCaller(self, stack_info=False, stacklevel=1):
         """
         Overload built-in findCaller method
         to omit not only logging/__init__.py but also the current file
         """
+        rv = "(unknown file)", 0, "(unknown function)", None
+        if not self.caller_info:
+            return rv
+
         f = logging.currentframe()
         #On some versions of IronPython, currentframe() returns None if
         #IronPython isn't run with -X:Frames.
         if f is not None:
             f = f.f_back
-        rv = "(unknown file)", 0, "(unknown function)", None
         while hasattr(f, "f_code"):
             co = f.f_code
-            filename = os.path.normcase(co.co_filename)
-            if filename in (logging._srcfile, _srcfile):
+            if is_internal_code(co):
+                f = f.f_back
+                continue
+            if stacklevel > 1 and f.f_back is not None:
+                stacklevel -= 1
                 f = f.f_back
                 continue
             sinfo = None